@@ -0,0 +1,5 @@
+#!/bin/sh
+# Passes the upload proxy secret to django with every upload body, see nginx.conf
+set -e
+printf 'proxy_set_header X-Upload-Proxy-Secret "%s";\n' \
+    "$(cat /run/secrets/upload_proxy_secret)" > /etc/nginx/upload_proxy_secret.conf
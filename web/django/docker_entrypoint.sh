@@ -6,4 +6,6 @@ python manage.py migrate --no-input
 python manage.py tailwind install --no-input
 python manage.py tailwind build --no-input
 python manage.py collectstatic --no-input 
-gunicorn -b 0.0.0.0:8080 ligand_service.wsgi --timeout 120
+# threads, so open event streams don't block other requests, streams are capped by
+# EVENT_STREAMS_PER_WORKER below the threads of each worker
+gunicorn -b 0.0.0.0:8080 ligand_service.wsgi --timeout 120 --worker-class gthread --workers ${GUNICORN_WORKERS:-4} --threads ${GUNICORN_THREADS:-32}
@@ -0,0 +1,266 @@
+import logging
+import shutil
+import time
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Sum
+from django.db.models.signals import post_init, post_save
+from django.dispatch import receiver
+
+from prometheus_client.core import REGISTRY, GaugeMetricFamily
+
+from .models import IN_QUEUE_STATUSES, Simulation
+
+# counters are recounted from the database this often, abandoned uploads stop
+# counting against their session then
+COUNTER_TIMEOUT = (settings.MAXIMUM_UPLOAD_TIME_IN_MINUTES or 60) * 60
+# reserved bytes are counted per time bucket, a reservation expires with its
+# bucket, so abandoned uploads stop counting without any cleanup
+RESERVATION_BUCKET_SECONDS = 300
+RESERVATION_BUCKETS = COUNTER_TIMEOUT // RESERVATION_BUCKET_SECONDS + 1
+# upload sizes are sent in decimal megabytes by the dashboard
+BYTES_PER_MB = 1000000
+
+
+logger = logging.getLogger(__name__)
+
+
+class UploadDeferred(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class UploadCapacity(NamedTuple):
+    free_bytes: int
+    # promised to admitted uploads that are not complete yet
+    in_flight_bytes: int
+    # not analysed yet, of simulations waiting for or in analysis
+    queued_frames: int
+
+
+def _counter_key(user_key: str) -> str:
+    return f"sims-in-queue:{user_key}"
+
+
+def _admission_key(user_key: str, upload_id: str) -> str:
+    return f"upload-admitted:{user_key}:{upload_id}"
+
+
+def _upload_bytes_key(user_key: str, upload_id: str) -> str:
+    return f"upload-bytes:{user_key}:{upload_id}"
+
+
+def _bucket_key(bucket: int) -> str:
+    return f"uploads-in-flight-bytes:{bucket}"
+
+
+def _current_bucket() -> int:
+    return int(time.time()) // RESERVATION_BUCKET_SECONDS
+
+
+def get_in_flight_bytes() -> int:
+    newest = _current_bucket()
+    buckets = cache.get_many(
+        [
+            _bucket_key(bucket)
+            for bucket in range(newest - RESERVATION_BUCKETS, newest + 1)
+        ]
+    )
+    # can drop below zero, when a bucket expired during uploads
+    return max(sum(buckets.values()), 0)
+
+
+def _ensure_counter(user_key: str) -> None:
+    if cache.get(_counter_key(user_key)) is None:
+        count = Simulation.objects.filter(
+            user_key=user_key, was_deleted=False, status__in=IN_QUEUE_STATUSES
+        ).count()
+        # add, increments of a concurrent request are not overwritten
+        cache.add(_counter_key(user_key), count, COUNTER_TIMEOUT)
+
+
+def _change_counter(user_key: str, delta: int) -> None:
+    try:
+        cache.incr(_counter_key(user_key), delta)
+    except ValueError:
+        # expired, recounted on the next admission
+        pass
+
+
+def get_capacity() -> UploadCapacity:
+    uploads_dir = settings.MEDIA_ROOT
+    if not uploads_dir.is_dir():
+        uploads_dir = settings.BASE_DIR
+    queued_frames = (
+        Simulation.objects.filter(
+            status__in=[
+                Simulation.Status.READY,
+                Simulation.Status.QUEUED,
+                Simulation.Status.RUNNING,
+            ],
+            was_deleted=False,
+            frame_count__isnull=False,
+        ).aggregate(frames=Sum(F("frame_count") - F("frames_done")))["frames"]
+        or 0
+    )
+    return UploadCapacity(
+        free_bytes=shutil.disk_usage(uploads_dir).free,
+        # can drop below zero, when the counter expired during uploads
+        in_flight_bytes=get_in_flight_bytes(),
+        queued_frames=queued_frames,
+    )
+
+
+def check_capacity(upload_bytes: int) -> None:
+    """Raises UploadDeferred, when the uploads volume or the analysis queue is full."""
+    capacity = get_capacity()
+    min_free_bytes = settings.UPLOADS_MIN_FREE_SPACE_IN_MB * BYTES_PER_MB
+    if capacity.free_bytes - capacity.in_flight_bytes - upload_bytes < min_free_bytes:
+        raise UploadDeferred(
+            "Not enough free space for uploads", settings.UPLOAD_RETRY_AFTER_SECONDS
+        )
+    if (
+        settings.MAXIMUM_QUEUED_FRAMES is not None
+        and capacity.queued_frames >= settings.MAXIMUM_QUEUED_FRAMES
+    ):
+        raise UploadDeferred(
+            "Too many frames waiting for analysis",
+            settings.UPLOAD_RETRY_AFTER_SECONDS,
+        )
+
+
+def _admit_to_session(user_key: str) -> bool:
+    if settings.MAXIMUM_UPLOADS_IN_QUEUE is None:
+        return True
+    _ensure_counter(user_key)
+    try:
+        count = cache.incr(_counter_key(user_key))
+    except ValueError:
+        # expired in between, admitted without counting, recounted later
+        return True
+    if count > settings.MAXIMUM_UPLOADS_IN_QUEUE:
+        _change_counter(user_key, -1)
+        return False
+    return True
+
+
+def _reserve_bytes(user_key: str, upload_id: str, upload_bytes: int) -> None:
+    bucket = _current_bucket()
+    bucket_timeout = (RESERVATION_BUCKETS + 1) * RESERVATION_BUCKET_SECONDS
+    cache.add(_bucket_key(bucket), 0, bucket_timeout)
+    try:
+        cache.incr(_bucket_key(bucket), upload_bytes)
+    except ValueError:
+        return
+    cache.set(
+        _upload_bytes_key(user_key, upload_id),
+        (upload_bytes, bucket),
+        COUNTER_TIMEOUT,
+    )
+
+
+def admit_upload(user_key: str, upload_id: str, upload_bytes: int) -> bool:
+    """Decides once per upload, whether the session may queue another simulation.
+
+    An admitted upload counts against the session and reserves its size on the
+    uploads volume right away, later chunks of the upload only read the decision.
+    Raises UploadDeferred without deciding, when the server can not take the
+    upload now, the client retries the chunk later.
+    """
+    admission_key = _admission_key(user_key, upload_id)
+    decision = cache.get(admission_key)
+    if decision is not None:
+        return decision
+    check_capacity(upload_bytes)
+    if not cache.add(admission_key, True, COUNTER_TIMEOUT):
+        # a concurrent chunk of the same upload decides
+        return cache.get(admission_key, True)
+    if not _admit_to_session(user_key):
+        cache.set(admission_key, False, COUNTER_TIMEOUT)
+        logger.info(f"Rejecting upload {upload_id} due to queue limit")
+        return False
+    _reserve_bytes(user_key, upload_id, upload_bytes)
+    return True
+
+
+def _released_bytes_key(user_key: str, upload_id: str) -> str:
+    return f"upload-released-bytes:{user_key}:{upload_id}"
+
+
+def _release_from_bucket(bucket: int, released_bytes: int) -> None:
+    try:
+        cache.decr(_bucket_key(bucket), released_bytes)
+    except ValueError:
+        # expired with its bucket
+        pass
+
+
+def release_allocated_bytes(user_key: str, upload_id: str, allocated_bytes: int):
+    """Releases the part of a reservation allocated on disk, free space shows it now."""
+    reservation = cache.get(_upload_bytes_key(user_key, upload_id))
+    if reservation is None or allocated_bytes <= 0:
+        return
+    _, bucket = reservation
+    # counted atomically, files of one upload are allocated by different workers
+    cache.add(_released_bytes_key(user_key, upload_id), 0, COUNTER_TIMEOUT)
+    try:
+        cache.incr(_released_bytes_key(user_key, upload_id), allocated_bytes)
+    except ValueError:
+        return
+    _release_from_bucket(bucket, allocated_bytes)
+
+
+def release_upload(user_key: str, upload_id: str) -> None:
+    """Releases the rest of the space reserved by an upload, once its files are on disk."""
+    reservation = cache.get(_upload_bytes_key(user_key, upload_id))
+    if reservation is None:
+        return
+    released_bytes = cache.get(_released_bytes_key(user_key, upload_id), 0)
+    cache.delete_many(
+        [
+            _upload_bytes_key(user_key, upload_id),
+            _released_bytes_key(user_key, upload_id),
+        ]
+    )
+    upload_bytes, bucket = reservation
+    if upload_bytes > released_bytes:
+        _release_from_bucket(bucket, upload_bytes - released_bytes)
+
+
+class UploadCapacityCollector:
+    """Exposes the upload capacity on /metrics, read when scraped."""
+
+    METRICS = {
+        "uploads_volume_free_bytes": "Free space on the uploads volume",
+        "uploads_in_flight_bytes": "Space reserved by uploads in progress",
+        "analysis_queued_frames": "Frames waiting for analysis",
+    }
+
+    def describe(self):
+        # registering does not query the database
+        for name, documentation in self.METRICS.items():
+            yield GaugeMetricFamily(name, documentation)
+
+    def collect(self):
+        for (name, documentation), value in zip(self.METRICS.items(), get_capacity()):
+            yield GaugeMetricFamily(name, documentation, value=value)
+
+
+REGISTRY.register(UploadCapacityCollector())
+
+
+@receiver(post_init, sender=Simulation)
+def remember_queue_state(sender, instance: Simulation, **kwargs):
+    instance._was_in_queue = instance.is_in_queue()
+
+
+@receiver(post_save, sender=Simulation)
+def update_queue_counter(sender, instance: Simulation, created: bool, **kwargs):
+    # created simulations were counted when their upload was admitted
+    in_queue = instance.is_in_queue()
+    if not created and in_queue != instance._was_in_queue:
+        _change_counter(instance.user_key, 1 if in_queue else -1)
+    instance._was_in_queue = in_queue
@@ -1,5 +1,7 @@
 import sys
 import os
+import signal
+import contextlib
 import subprocess as sb
 from pathlib import Path
 from typing import Any
@@ -8,18 +10,41 @@ import datetime
 import re
 import logging
 import shutil
+import sqlite3
+import functools
+import hashlib
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, NamedTuple
 
 import requests
+import numpy as np
+import pandas as pd
 from vmd import molecule, atomsel
-from Bio import SearchIO
+from Bio import SearchIO, SeqIO
+from Bio.Align import PairwiseAligner
 
-from .models import GPCRdbResidueAPI
+from .models import ChainNumbering
+from . import gpcrdb
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
 BLASTP_PATH = "blastp"
 BLASTDB_PATH = Path("blast/blast_db").absolute()
+RECEPTORS_FASTA_PATH = Path("blast/receptors.fasta").absolute()
+GPCRDB_RESIDUES_BUNDLE_PATH = Path("blast/gpcrdb_residues.sqlite").absolute()
+
+NUMBERING_KEY_COLUMNS = ["Residue chain", "Residue name", "Residue number"]
+# "Aligned numbering" is the GPCRdb number, or the segment of unnumbered residues
+NUMBERING_COLUMNS = ["Aligned numbering", "GPCRdb numbering", "BW numbering", "Segment"]
+
+KMER_SIZE = 3
+ALIGNMENT_CANDIDATES = 5
+# Karlin-Altschul parameters of BLOSUM62 with gap costs 11/1, used to estimate e-values
+KARLIN_ALTSCHUL_LAMBDA = 0.267
+KARLIN_ALTSCHUL_K = 0.041
 
 DYNAMIC_CONTACTS_PATH = os.path.abspath("getcontacts/get_dynamic_contacts.py")
 CURRENT_INTERPRETER_PATH = sys.executable
@@ -27,8 +52,18 @@ CORES_AVAILABLE = "12"
 GPCRDB_NUMBERING_ENDPOINT = (
     "https://gpcrdb.org/services/structure/assign_generic_numbers"
 )
-GPCRDB_RESIDUES_EXTENDED_ENDPOINT = "https://gpcrdb.org/services/residues/extended/"
 THREADS_FOR_PLIP = os.environ.get("THREADS_FOR_PLIP", "1")
+# seconds between progress reports of running PLIP instances
+PLIP_PROGRESS_INTERVAL = 2
+# seconds PLIP gets to exit when the analysis is cancelled, before it is killed
+PLIP_TERMINATE_TIMEOUT = 5
+# frames written between checks for cancellation
+CANCELLATION_CHECK_FRAMES = 50
+
+
+class AnalysisCancelled(Exception):
+    pass
+
 
 THREE_TO_ONE = {
     "ALA": "A",
@@ -108,28 +143,6 @@ def get_numbering(pdb_file: Path, outfile: Path):
         )
 
 
-def get_residues_extended(uniprot_identifier: str) -> list[dict[Any, Any]] | None:
-    try:
-        cached_request = GPCRdbResidueAPI.objects.get(
-            uniprot_identifier=uniprot_identifier
-        )
-        print("Returning cached response...", flush=True)
-        return cached_request.response_json
-    except Exception:
-        url = GPCRDB_RESIDUES_EXTENDED_ENDPOINT + uniprot_identifier
-        print(f"Calling GPCRdb: {url}")
-        response = requests.post(url)
-        if response.ok:
-            print("Call successful", flush=True)
-            response_json = response.json()
-            GPCRdbResidueAPI.objects.create(
-                uniprot_identifier=uniprot_identifier, response_json=response_json
-            ).save()
-            return response_json
-        print(f"Call failed: {response.status_code}", flush=True)
-    return None
-
-
 # previously used to verify blast alignment
 
 # def create_translation_dict_by_pdb(
@@ -179,7 +192,40 @@ def get_residues_extended(uniprot_identifier: str) -> list[dict[Any, Any]] | Non
 #     return trans_dict
 
 
-def blast_sequence(seq: str) -> SearchIO.HSP | None:
+class AlignmentHit(NamedTuple):
+    hit_id: str
+    evalue: float
+    # boundaries of ungapped blocks: (start, end, start, end, ...)
+    hit_range: tuple[int, ...]
+    query_range: tuple[int, ...]
+
+
+def _ungapped_blocks(
+    hit_aligned: str, query_aligned: str, hit_start: int, query_start: int
+) -> tuple[tuple[int, ...], tuple[int, ...]]:
+    hit_range = []
+    query_range = []
+    hit_idx, query_idx = hit_start, query_start
+    in_block = False
+    for hit_res, query_res in zip(hit_aligned, query_aligned):
+        if hit_res != "-" and query_res != "-":
+            if not in_block:
+                hit_range.append(hit_idx)
+                query_range.append(query_idx)
+                in_block = True
+        elif in_block:
+            hit_range.append(hit_idx)
+            query_range.append(query_idx)
+            in_block = False
+        hit_idx += hit_res != "-"
+        query_idx += query_res != "-"
+    if in_block:
+        hit_range.append(hit_idx)
+        query_range.append(query_idx)
+    return tuple(hit_range), tuple(query_range)
+
+
+def blast_sequence(seq: str) -> AlignmentHit | None:
     print("Starting blast with seq:", seq, flush=True)
     results_file = tempfile.NamedTemporaryFile(suffix=".xml")
     job = sb.run(
@@ -209,10 +255,86 @@ def blast_sequence(seq: str) -> SearchIO.HSP | None:
     blast_qresult: SearchIO.QueryResult = SearchIO.read(results_file, "blast-xml")
     for hit in blast_qresult:
         for hsp in hit:
-            return hsp
+            hit_range, query_range = _ungapped_blocks(
+                str(hsp.hit.seq), str(hsp.query.seq), hsp.hit_start, hsp.query_start
+            )
+            return AlignmentHit(hsp.hit_id, hsp.evalue, hit_range, query_range)
     return None
 
 
+class ReceptorIndex:
+    """Receptor sequences held in memory, with a k-mer index to pick alignment candidates."""
+
+    def __init__(self, fasta_path: Path) -> None:
+        records = list(SeqIO.parse(fasta_path, "fasta"))
+        self.ids = [record.id for record in records]
+        self.sequences = [str(record.seq) for record in records]
+        self.total_length = sum(len(seq) for seq in self.sequences)
+        kmer_receptors: dict[str, set[int]] = {}
+        for idx, seq in enumerate(self.sequences):
+            for kmer in _kmers(seq):
+                kmer_receptors.setdefault(kmer, set()).add(idx)
+        self.kmer_receptors = {
+            kmer: np.fromiter(receptors, dtype=np.int32)
+            for kmer, receptors in kmer_receptors.items()
+        }
+        self.aligner = PairwiseAligner(scoring="blastp")
+        self.aligner.mode = "local"
+
+    def candidates(self, seq: str, count: int = ALIGNMENT_CANDIDATES) -> list[int]:
+        """Receptors sharing the most k-mers with the sequence."""
+        hits = [
+            self.kmer_receptors[kmer]
+            for kmer in _kmers(seq)
+            if kmer in self.kmer_receptors
+        ]
+        if len(hits) == 0:
+            return []
+        shared = np.bincount(np.concatenate(hits), minlength=len(self.sequences))
+        best = np.argsort(shared)[::-1][:count]
+        return [int(idx) for idx in best if shared[idx] > 0]
+
+    def align(self, seq: str) -> AlignmentHit | None:
+        best_alignment = None
+        best_idx = None
+        for idx in self.candidates(seq):
+            alignment = self.aligner.align(self.sequences[idx], seq)[0]
+            if best_alignment is None or alignment.score > best_alignment.score:
+                best_alignment = alignment
+                best_idx = idx
+        if best_alignment is None or best_idx is None:
+            return None
+        hit_blocks, query_blocks = best_alignment.aligned
+        evalue = (
+            KARLIN_ALTSCHUL_K
+            * len(seq)
+            * self.total_length
+            * math.exp(-KARLIN_ALTSCHUL_LAMBDA * best_alignment.score)
+        )
+        return AlignmentHit(
+            hit_id=self.ids[best_idx],
+            evalue=evalue,
+            hit_range=tuple(int(x) for block in hit_blocks for x in block),
+            query_range=tuple(int(x) for block in query_blocks for x in block),
+        )
+
+
+def _kmers(seq: str) -> set[str]:
+    return {seq[i : i + KMER_SIZE] for i in range(len(seq) - KMER_SIZE + 1)}
+
+
+@functools.cache
+def get_receptor_index() -> ReceptorIndex:
+    # loaded once per worker process
+    return ReceptorIndex(RECEPTORS_FASTA_PATH)
+
+
+def align_sequence(seq: str) -> AlignmentHit | None:
+    if settings.SEQUENCE_ALIGNER == "blast":
+        return blast_sequence(seq)
+    return get_receptor_index().align(seq)
+
+
 def get_sequence(pdb: Path):
     with open(pdb, "r") as f:
         next(f)
@@ -240,76 +362,263 @@ def extract_uniprot_accession(target_description: str) -> str:
     return target_description.split("|")[0]
 
 
-def create_translation_dict_by_blast(
-    topology: Path, trajectory: Path
-) -> tuple[dict[tuple[str, str, str], str], dict[str, tuple[str, str]]] | None:
-    seq_chains = get_sequence_chains(topology, trajectory)
-    result_dict = {}
-    alignment_scores = {}
-    for chain in seq_chains:
-        seq = "".join([res_name[1] for res_name in sorted(seq_chains[chain].items())])
-        alignment = blast_sequence(seq)
-        if alignment is None:
-            print("FAILED TO GET ALIGNMENT!", flush=True)
+@functools.cache
+def get_receptor_db_version() -> str:
+    # numbering depends on the receptor sequences, the aligner and GPCRdb residues
+    digest = hashlib.sha256(RECEPTORS_FASTA_PATH.read_bytes())
+    digest.update(settings.SEQUENCE_ALIGNER.encode())
+    if GPCRDB_RESIDUES_BUNDLE_PATH.is_file():
+        digest.update(GPCRDB_RESIDUES_BUNDLE_PATH.read_bytes())
+    return digest.hexdigest()
+
+
+def chain_numbering_key(residues: dict[int, str]) -> str:
+    """Hash of the chain sequence, its residue numbers and the receptor DB version."""
+    ordered = sorted(residues.items())
+    digest = hashlib.sha256("".join(aa for _, aa in ordered).encode())
+    digest.update(",".join(str(idx) for idx, _ in ordered).encode())
+    digest.update(get_receptor_db_version().encode())
+    digest.update(",".join(NUMBERING_COLUMNS).encode())
+    return digest.hexdigest()
+
+
+class ResidueTable(NamedTuple):
+    """GPCRdb residues of one receptor, every array is indexed by sequence number."""
+
+    known: np.ndarray
+    residue_name: np.ndarray
+    # one column per numbering scheme
+    numbering: np.ndarray
+
+
+# per process, residues of a receptor do not change between analyses
+_residue_tables: dict[str, ResidueTable] = {}
+
+
+def _residue_numbering(residue: dict[Any, Any]) -> tuple[str, str, str, str]:
+    """Numbering of a residue in every scheme of NUMBERING_COLUMNS."""
+    # e.g. "3.50x50", the Ballesteros-Weinstein number followed by the GPCRdb one
+    value = residue.get("display_generic_number", "")
+    segment = residue.get("protein_segment") or ""
+    gpcrdb_number = re.sub(r"(\.\d*)", "", value) if value else ""
+    bw_number = value.split("x")[0] if value else ""
+    aligned = gpcrdb_number if value is not None else segment
+    return aligned, gpcrdb_number, bw_number, segment
+
+
+def build_residue_table(residue_info: list[dict[Any, Any]]) -> ResidueTable:
+    size = max([residue["sequence_number"] for residue in residue_info], default=0)
+    known = np.zeros(size + 1, dtype=bool)
+    residue_name = np.full(size + 1, "", dtype=object)
+    numbering = np.full((size + 1, len(NUMBERING_COLUMNS)), "", dtype=object)
+    for residue in residue_info:
+        idx = residue["sequence_number"]
+        known[idx] = True
+        residue_name[idx] = ONE_TO_THREE.get(residue["amino_acid"], "UNK")
+        numbering[idx] = _residue_numbering(residue)
+    return ResidueTable(known, residue_name, numbering)
+
+
+def get_bundled_residues(uniprot_identifier: str) -> list[dict[Any, Any]] | None:
+    """Residues from the bundle created by setup/getresidues.py, no network needed."""
+    if not GPCRDB_RESIDUES_BUNDLE_PATH.is_file():
+        return None
+    db = sqlite3.connect(f"file:{GPCRDB_RESIDUES_BUNDLE_PATH}?mode=ro", uri=True)
+    try:
+        db.row_factory = sqlite3.Row
+        rows = db.execute(
+            "SELECT sequence_number, amino_acid, display_generic_number, protein_segment "
+            "FROM residues WHERE uniprot = ?",
+            (uniprot_identifier,),
+        ).fetchall()
+    finally:
+        db.close()
+    if len(rows) == 0:
+        return None
+    return [dict(row) for row in rows]
+
+
+def get_residue_tables(uniprot_identifiers: set[str]) -> dict[str, ResidueTable]:
+    missing = []
+    for uniprot_identifier in uniprot_identifiers:
+        if uniprot_identifier in _residue_tables:
             continue
-        named_atoms = []
-        for idx in seq_chains[chain]:
-            # create (chain, residue_name, residue_idx) triplets
-            named_atoms.append((chain, ONE_TO_THREE[seq_chains[chain][idx]], str(idx)))
-            # sort by residue_idx
-        named_atoms.sort(key=lambda x: int(x[2]))
-        ident = extract_uniprot_entry_name(alignment.hit_id)
-        accession = extract_uniprot_accession(alignment.hit_id)
-        residue_info = get_residues_extended(ident)
+        residue_info = get_bundled_residues(uniprot_identifier)
         if residue_info is None:
-            print(
-                f"Failed to get info from GPCRdb API, requested uniprot identifier: {ident}",
-                flush=True,
+            print(f"{uniprot_identifier} missing from the residue bundle", flush=True)
+            missing.append(uniprot_identifier)
+            continue
+        _residue_tables[uniprot_identifier] = build_residue_table(residue_info)
+    # receptors of different chains are fetched concurrently
+    for uniprot_identifier, residue_info in gpcrdb.get_residues_many(missing).items():
+        if residue_info is not None:
+            _residue_tables[uniprot_identifier] = build_residue_table(residue_info)
+    return {
+        uniprot_identifier: _residue_tables[uniprot_identifier]
+        for uniprot_identifier in uniprot_identifiers
+        if uniprot_identifier in _residue_tables
+    }
+
+
+def _block_indices(block_range: tuple[int, ...]) -> np.ndarray:
+    """Expands (start, end, start, end, ...) block boundaries into indices."""
+    blocks = [
+        np.arange(start, end) for start, end in zip(block_range[::2], block_range[1::2])
+    ]
+    return np.concatenate(blocks) if len(blocks) > 0 else np.zeros(0, dtype=int)
+
+
+def chain_sequence(residues: dict[int, str]) -> str:
+    return "".join([res_name[1] for res_name in sorted(residues.items())])
+
+
+def number_chain(
+    residues: dict[int, str],
+    alignment: AlignmentHit | None,
+    residue_tables: dict[str, ResidueTable],
+) -> ChainNumbering | None:
+    """Maps residues of an aligned chain to generic numbers.
+
+    The mapping does not depend on the chain name, so it is stored for every chain
+    with the same sequence and residue numbering.
+    """
+    if alignment is None:
+        print("FAILED TO GET ALIGNMENT!", flush=True)
+        return None
+    # (residue_name, residue_idx) pairs, sorted by residue_idx
+    named_residues = [
+        (ONE_TO_THREE[residues[idx]], str(idx)) for idx in sorted(residues)
+    ]
+    ident = extract_uniprot_entry_name(alignment.hit_id)
+    accession = extract_uniprot_accession(alignment.hit_id)
+    residue_table = residue_tables.get(ident)
+    if residue_table is None:
+        print(
+            f"Failed to get info from GPCRdb API, requested uniprot identifier: {ident}",
+            flush=True,
+        )
+        return None
+    print(f"ALIGNMENT SCORE: {(ident, accession, alignment.evalue)}", flush=True)
+    print(alignment.hit_range, flush=True)
+    print(alignment.query_range, flush=True)
+    query_idx = _block_indices(alignment.query_range)
+    # sequence_number starts from 1, while coordinates start from 0
+    sequence_numbers = _block_indices(alignment.hit_range) + 1
+    known = sequence_numbers < len(residue_table.known)
+    known[known] = residue_table.known[sequence_numbers[known]]
+    query_idx = query_idx[known]
+    sequence_numbers = sequence_numbers[known]
+
+    residue_names = np.array([name for name, _ in named_residues])[query_idx]
+    target_names = residue_table.residue_name[sequence_numbers]
+    # compare amino acids
+    for idx in np.flatnonzero(residue_names != target_names):
+        print(
+            f"MAPING MISMATCH: {named_residues[query_idx[idx]]} : {target_names[idx]}",
+            flush=True,
+        )
+    numbering = dict(
+        zip(
+            [named_residues[idx] for idx in query_idx],
+            residue_table.numbering[sequence_numbers].tolist(),
+        )
+    )
+    for residue in named_residues:
+        if residue not in numbering:
+            print(f"RESIDUE NOT MAPPED! {residue}", flush=True)
+    numbered_chain, _ = ChainNumbering.objects.get_or_create(
+        sequence_hash=chain_numbering_key(residues),
+        defaults={
+            "uniprot_identifier": ident,
+            "accession": accession,
+            "evalue": alignment.evalue,
+            "numbering": [[*k, *v] for k, v in numbering.items()],
+        },
+    )
+    return numbered_chain
+
+
+def create_numbering_table(
+    seq_chains: dict[str, dict[int, str]],
+) -> tuple[pd.DataFrame, dict[str, tuple[str, str, float]]] | None:
+    """Numbering of every mapped residue, one row per (chain, name, number).
+
+    Needs only the sequences from get_sequence_chains, no VMD calls are made, so it
+    can run in a thread next to the frame analysis.
+    """
+    chain_keys = {
+        chain: chain_numbering_key(residues) for chain, residues in seq_chains.items()
+    }
+    numbered_chains = {
+        numbered_chain.sequence_hash: numbered_chain
+        for numbered_chain in ChainNumbering.objects.filter(
+            sequence_hash__in=set(chain_keys.values())
+        )
+    }
+    print(f"Numbering cached for {len(numbered_chains)} chains", flush=True)
+    # homomeric chains share the key, so they are aligned only once
+    missing = {
+        key: seq_chains[chain]
+        for chain, key in chain_keys.items()
+        if key not in numbered_chains
+    }
+    with ThreadPoolExecutor(max_workers=max(1, len(missing))) as executor:
+        alignments = dict(
+            zip(
+                missing,
+                executor.map(align_sequence, map(chain_sequence, missing.values())),
             )
+        )
+    # chains aligned to the same receptor share its residues
+    residue_tables = get_residue_tables(
+        {
+            extract_uniprot_entry_name(alignment.hit_id)
+            for alignment in alignments.values()
+            if alignment is not None
+        }
+    )
+    for key, residues in missing.items():
+        numbered_chains[key] = number_chain(residues, alignments[key], residue_tables)
+
+    rows = []
+    alignment_scores = {}
+    for chain, key in chain_keys.items():
+        numbered_chain = numbered_chains[key]
+        if numbered_chain is None:
             continue
-        alignment_scores[chain] = (ident, accession, alignment.evalue)
-        print(f"ALIGNMENT SCORES: {alignment_scores}", flush=True)
-        # creates a list of tuples, where first element is the start index and second is the end index
-        # (start idx, end idx)
-        target_slices = list(zip(alignment.hit_range[::2], alignment.hit_range[1::2]))
-        query_slices = list(
-            zip(alignment.query_range[::2], alignment.query_range[1::2])
+        alignment_scores[chain] = (
+            numbered_chain.uniprot_identifier,
+            numbered_chain.accession,
+            numbered_chain.evalue,
         )
-        print(target_slices, flush=True)
-        print(query_slices, flush=True)
-        chain_result = {}
-        for qs, ts in zip(query_slices, target_slices):
-            keys = named_atoms[qs[0] : qs[1]]
-            values = []
-            for idx in range(ts[0], ts[1]):
-                for amino_acid in residue_info:
-                    # sequence_number starts from 1, while coordinates start from 0
-                    if amino_acid["sequence_number"] == idx + 1:
-                        values.append(amino_acid)
-                        break
-            for k, v in zip(keys, values):
-                # compare amino acids
-                if k[1] != ONE_TO_THREE[v["amino_acid"]]:
-                    print(
-                        f"MAPING MISMATCH: {k} : {ONE_TO_THREE[v['amino_acid']]}",
-                        flush=True,
-                    )
-                value = v.get("display_generic_number", "")
-                chain_result[k] = (
-                    re.sub(r"(\.\d*)", "", value)
-                    if value is not None
-                    else v["protein_segment"]
-                )
-        for atom in named_atoms:
-            if atom not in chain_result:
-                print(f"ATOM NOT MAPPED! {atom}", flush=True)
         # merge results from each chain
-        result_dict = {**result_dict, **chain_result}
-    return (result_dict, alignment_scores) if len(result_dict) > 0 else None
+        rows.extend([chain, *residue] for residue in numbered_chain.numbering)
+    print(f"ALIGNMENT SCORES: {alignment_scores}", flush=True)
+    if len(rows) == 0:
+        return None
+    return pd.DataFrame(rows, columns=NUMBERING_KEY_COLUMNS + NUMBERING_COLUMNS), (
+        alignment_scores
+    )
+
+
+def annotate_numbering(
+    interactions_df: pd.DataFrame, numbering_df: pd.DataFrame
+) -> pd.DataFrame:
+    """Joins the numbering of every scheme onto the interactions in one merge."""
+    numbering_df = numbering_df.drop_duplicates(subset=NUMBERING_KEY_COLUMNS).astype(
+        {"Residue number": interactions_df["Residue number"].dtype}
+    )
+    return interactions_df.drop(columns=NUMBERING_COLUMNS, errors="ignore").merge(
+        numbering_df, how="left", on=NUMBERING_KEY_COLUMNS
+    )
 
 
 def get_results_plip(
-    pdbfiles: list[Path], outdir: Path | None = None, worker_count: int = 1
+    pdbfiles: list[Path],
+    outdir: Path | None = None,
+    worker_count: int = 1,
+    on_progress: Callable[[int], None] | None = None,
+    is_cancelled: Callable[[], bool] | None = None,
 ):
     if outdir is not None:
         prev_wd = os.getcwd()
@@ -325,6 +634,7 @@ def get_results_plip(
         print(f"Starting plip instance with: {len(pdbfiles_part)} frames")
         if len(pdbfiles_part) == 0:
             continue
+        # output goes to the worker log, an unread pipe would stall PLIP once full
         process = sb.Popen(
             [
                 "plip",
@@ -333,22 +643,55 @@ def get_results_plip(
                 "-f",
             ]
             + pdbfiles_part,
-            stdout=sb.PIPE,
-            stderr=sb.STDOUT,
-            text=True,
-            bufsize=1,
+            # own process group, so PLIP can be stopped together with its children
+            start_new_session=True,
         )
         processes.append(process)
 
     if outdir is not None:
         os.chdir(prev_wd)
 
-    assert process.stdout is not None
-
-    [process.wait() for process in processes]
-    process.wait()
+    frames_done = 0
+    try:
+        while any(process.poll() is None for process in processes):
+            time.sleep(PLIP_PROGRESS_INTERVAL)
+            if is_cancelled is not None and is_cancelled():
+                raise AnalysisCancelled("PLIP stopped, the analysis was cancelled")
+            if on_progress is None or outdir is None:
+                continue
+            # PLIP writes one entry per analysed frame
+            current = sum(1 for _ in outdir.iterdir())
+            if current != frames_done:
+                frames_done = current
+                on_progress(frames_done)
+    except BaseException:
+        # also on worker shutdown, PLIP would keep the cores busy otherwise
+        stop_processes(processes)
+        raise
     print("PLIP: Done!")
-    return process.returncode == 0
+    return all(process.returncode == 0 for process in processes)
+
+
+def stop_processes(processes: list[sb.Popen]):
+    """Terminates the process groups, kills the ones still running after a timeout."""
+    for process in processes:
+        with contextlib.suppress(ProcessLookupError):
+            os.killpg(process.pid, signal.SIGTERM)
+    deadline = time.monotonic() + PLIP_TERMINATE_TIMEOUT
+    for process in processes:
+        try:
+            process.wait(timeout=max(0, deadline - time.monotonic()))
+        except sb.TimeoutExpired:
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+
+
+def get_atom_count(topology_file: Path) -> int:
+    molid = molecule.load(filetype(topology_file), str(topology_file))
+    count = molecule.numatoms(molid)
+    molecule.delete(molid)
+    return count
 
 
 def get_trajectory_frame_count(topology_file: Path, trajectory_file: Path) -> int:
@@ -399,7 +742,11 @@ residue_map = {
 
 
 def get_frames_from_trajectory(
-    topology_file: Path, trajectory_file: Path, outdir: Path, frames: list[int]
+    topology_file: Path,
+    trajectory_file: Path,
+    outdir: Path,
+    frames: list[int],
+    is_cancelled: Callable[[], bool] | None = None,
 ) -> list[Path]:
     molid = molecule.load(filetype(topology_file), str(topology_file))
     num_frames = molecule.numframes(molid)
@@ -428,7 +775,14 @@ def get_frames_from_trajectory(
         residues = atomsel(f"resname {nonstandard_name}", molid=molid)
         residues.resname = standard_name
 
-    for frame in frames:
+    for idx, frame in enumerate(frames):
+        if (
+            is_cancelled is not None
+            and idx % CANCELLATION_CHECK_FRAMES == 0
+            and is_cancelled()
+        ):
+            molecule.delete(molid)
+            raise AnalysisCancelled("Frame extraction stopped, analysis cancelled")
         protein = atomsel(
             "(not lipid) and (same fragment as (within 7 of protein))",
             molid=molid,
@@ -453,17 +807,33 @@ def get_interactions_from_trajectory(
     plip_dir: Path,
     frames_dir: Path,
     frames: list[int],
-):
+    on_progress: Callable[[int], None] | None = None,
+    is_cancelled: Callable[[], bool] | None = None,
+) -> dict[str, float]:
+    """Runs PLIP on the frames, returns seconds spent in each stage."""
     frames_dir.mkdir(parents=True)
     plip_dir.mkdir(parents=True)
     tick = datetime.datetime.now()
-    pdbs = get_frames_from_trajectory(
-        topology_file, trajectory_file, frames_dir, frames
-    )
+    timings = {}
     try:
-        get_results_plip(pdbs, plip_dir, settings.MAX_THREADS_PER_WORKER)
+        stage_start = time.monotonic()
+        pdbs = get_frames_from_trajectory(
+            topology_file, trajectory_file, frames_dir, frames, is_cancelled
+        )
+        timings["extraction"] = time.monotonic() - stage_start
+        stage_start = time.monotonic()
+        get_results_plip(
+            pdbs,
+            plip_dir,
+            settings.MAX_THREADS_PER_WORKER,
+            on_progress,
+            is_cancelled,
+        )
+        timings["plip"] = time.monotonic() - stage_start
     finally:
-        shutil.rmtree(frames_dir)
+        # the simulation may have been deleted meanwhile
+        shutil.rmtree(frames_dir, ignore_errors=True)
     tock = datetime.datetime.now()
     print("Done...")
     print("Running time: ", (tock - tick))
+    return timings
@@ -0,0 +1,253 @@
+from typing import NamedTuple
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# upper bound of array elements created by one batch of permutations / resamples
+MAX_BATCH_ELEMENTS = 2**24
+
+
+class GroupCorrelations(NamedTuple):
+    # (interaction type, residue label) pairs, one per column of the count matrix
+    features: pd.MultiIndex
+    properties: list[str]
+    # every statistic has shape (features, properties)
+    pearson: np.ndarray
+    spearman: np.ndarray
+    covariance: np.ndarray
+    # significance, NaN when permutations / bootstrap resamples were not requested
+    pearson_pvalue: np.ndarray
+    spearman_pvalue: np.ndarray
+    pearson_ci_low: np.ndarray
+    pearson_ci_high: np.ndarray
+    spearman_ci_low: np.ndarray
+    spearman_ci_high: np.ndarray
+
+    def frame(self, statistic: str, property_name: str) -> pd.DataFrame:
+        """Returns the statistic for one property as interaction types × residues."""
+        values = getattr(self, statistic)[:, self.properties.index(property_name)]
+        return pd.Series(values, index=self.features).unstack(level=1)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Returns all statistics as a long table, one row per feature and property."""
+        statistics = [
+            name for name in self._fields if name not in ("features", "properties")
+        ]
+        return pd.concat(
+            [
+                pd.DataFrame(
+                    {
+                        "Interaction type": self.features.get_level_values(0),
+                        "Residue": self.features.get_level_values(1),
+                        "Property": property_name,
+                        **{name: getattr(self, name)[:, idx] for name in statistics},
+                    }
+                )
+                for idx, property_name in enumerate(self.properties)
+            ],
+            ignore_index=True,
+        )
+
+
+def interaction_count_matrix(
+    summary_df: pd.DataFrame, sim_ids: list[str]
+) -> tuple[np.ndarray, pd.MultiIndex]:
+    """Builds the simulations × (interaction type, residue) interaction count matrix.
+
+    Simulations without interactions of a given residue and type have no count (NaN),
+    like the missing cells of a pivot table.
+    """
+    sim_codes = pd.Categorical(summary_df["Simulation ID"], categories=sim_ids).codes
+    feature_codes, features = pd.MultiIndex.from_frame(
+        summary_df[["Interaction type", "ResidueLabel"]]
+    ).factorize()
+    known = sim_codes >= 0
+
+    counts = np.zeros((len(sim_ids), len(features)))
+    np.add.at(
+        counts,
+        (sim_codes[known], feature_codes[known]),
+        summary_df["Interaction count"].to_numpy(dtype=float)[known],
+    )
+    observed = np.zeros(counts.shape, dtype=bool)
+    observed[sim_codes[known], feature_codes[known]] = True
+    counts[~observed] = np.nan
+    return counts, features
+
+
+def complete_pairs(counts: np.ndarray, values: np.ndarray):
+    """Groups (feature, property) pairs by the simulations observed in both.
+
+    Yields the observed simulations, the features and the property of every group.
+    Statistics of a group use its simulations only, like pandas' pairwise-complete
+    correlations, pairs observed in fewer than two simulations are skipped.
+    """
+    if counts.shape[1] == 0:
+        return
+    observed_counts = ~np.isnan(counts)
+    for property_idx in range(values.shape[1]):
+        observed = observed_counts & ~np.isnan(values[:, [property_idx]])
+        patterns, inverse = np.unique(observed.T, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        for pattern_idx, rows in enumerate(patterns):
+            if rows.sum() < 2:
+                continue
+            yield rows, np.flatnonzero(inverse == pattern_idx), property_idx
+
+
+def _centered(a: np.ndarray) -> np.ndarray:
+    return a - a.mean(axis=0)
+
+
+def _pearson(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    xc = _centered(x)
+    yc = _centered(y)
+    norms = np.outer(np.sqrt((xc**2).sum(axis=0)), np.sqrt((yc**2).sum(axis=0)))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (xc.T @ yc) / norms
+
+
+def _ranks(a: np.ndarray) -> np.ndarray:
+    # average ranks for ties, same as pandas' spearman correlation
+    return pd.DataFrame(a).rank(axis=0).to_numpy()
+
+
+def correlate(counts: np.ndarray, values: np.ndarray) -> dict[str, np.ndarray]:
+    """Correlates every count column with every property column in one pass."""
+    return {
+        "pearson": _pearson(counts, values),
+        "spearman": _pearson(_ranks(counts), _ranks(values)),
+        "covariance": _centered(counts).T @ _centered(values) / (len(counts) - 1),
+    }
+
+
+def _standardized(a: np.ndarray) -> np.ndarray:
+    ac = _centered(a)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return ac / np.sqrt((ac**2).sum(axis=0))
+
+
+def _batch_size(elements_per_item: int) -> int:
+    return max(1, MAX_BATCH_ELEMENTS // elements_per_item)
+
+
+def permutation_pvalues(
+    counts: np.ndarray,
+    values: np.ndarray,
+    permutations: int,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    """Two-sided permutation p-values of the Pearson correlations of counts and values.
+
+    Correlations under all permutations of the property values are batched matrix
+    products of the standardized counts and the permuted standardized values.
+    """
+    xs = _standardized(counts)
+    ys = _standardized(values)
+    observed = np.abs(xs.T @ ys)
+    n_sims, n_features = counts.shape
+    n_properties = values.shape[1]
+
+    exceeding = np.zeros_like(observed)
+    batch_size = _batch_size((n_sims + n_features) * n_properties)
+    for start in range(0, permutations, batch_size):
+        batch = min(batch_size, permutations - start)
+        order = rng.permuted(np.tile(np.arange(n_sims), (batch, 1)), axis=1)
+        permuted = np.abs(np.einsum("nf,bne->bfe", xs, ys[order]))
+        # small tolerance, so ties with the observed value are not lost to rounding
+        exceeding += (permuted >= observed - 1e-12).sum(axis=0)
+    pvalues = (exceeding + 1) / (permutations + 1)
+    # features without variance can not be tested
+    pvalues[np.isnan(observed)] = np.nan
+    return pvalues
+
+
+def bootstrap_intervals(
+    counts: np.ndarray,
+    values: np.ndarray,
+    resamples: int,
+    rng: np.random.Generator,
+    confidence: float = 0.95,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Percentile bootstrap confidence intervals of the Pearson correlations.
+
+    Simulations are resampled with replacement, the same resamples for every
+    feature. Features are processed in blocks, so only the estimates of one block
+    are kept in memory, correlations of a batch of resamples are computed at once.
+    """
+    n_sims, n_features = counts.shape
+    n_properties = values.shape[1]
+    samples = rng.integers(0, n_sims, size=(resamples, n_sims))
+    yc = values[samples]
+    yc = yc - yc.mean(axis=1, keepdims=True)
+    y_norms = np.sqrt((yc**2).sum(axis=1))
+
+    tail = 100 * (1 - confidence) / 2
+    low = np.empty((n_features, n_properties))
+    high = np.empty((n_features, n_properties))
+    block_size = _batch_size(resamples * n_properties)
+    for block_start in range(0, n_features, block_size):
+        block = slice(block_start, min(block_start + block_size, n_features))
+        block_counts = counts[:, block]
+        block_width = block_counts.shape[1]
+        estimates = np.empty((resamples, block_width, n_properties))
+        batch_size = _batch_size(n_sims * block_width)
+        for start in range(0, resamples, batch_size):
+            batch = slice(start, min(start + batch_size, resamples))
+            xb = block_counts[samples[batch]]
+            xb = xb - xb.mean(axis=1, keepdims=True)
+            norms = np.einsum(
+                "bf,be->bfe", np.sqrt((xb**2).sum(axis=1)), y_norms[batch]
+            )
+            with np.errstate(invalid="ignore", divide="ignore"):
+                estimates[batch] = np.einsum("bnf,bne->bfe", xb, yc[batch]) / norms
+
+        with warnings.catch_warnings():
+            # features without variance in every resample have no interval
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            low[block], high[block] = np.nanpercentile(
+                estimates, [tail, 100 - tail], axis=0
+            )
+    return low, high
+
+
+def compute_group_correlations(
+    summary_df: pd.DataFrame,
+    exp_data: pd.DataFrame,
+    permutations: int = 0,
+    resamples: int = 0,
+    seed: int | None = None,
+) -> GroupCorrelations:
+    properties = exp_data.columns.to_list()[2:]
+    counts, features = interaction_count_matrix(
+        summary_df, exp_data["Simulation ID"].to_list()
+    )
+    values = exp_data[properties].to_numpy(dtype=float)
+
+    rng = np.random.default_rng(seed)
+    # NaN where not computed, spearman intervals are never computed, resampling
+    # would need ranks recomputed for every resample
+    statistics = {
+        name: np.full((len(features), len(properties)), np.nan)
+        for name in GroupCorrelations._fields
+        if name not in ("features", "properties")
+    }
+    for rows, columns, property_idx in complete_pairs(counts, values):
+        x = counts[np.ix_(rows, columns)]
+        y = values[rows][:, [property_idx]]
+        results = correlate(x, y)
+        if permutations > 0:
+            results["pearson_pvalue"] = permutation_pvalues(x, y, permutations, rng)
+            # spearman is pearson of the ranks, permuting ranks permutes values
+            results["spearman_pvalue"] = permutation_pvalues(
+                _ranks(x), _ranks(y), permutations, rng
+            )
+        if resamples > 0:
+            results["pearson_ci_low"], results["pearson_ci_high"] = bootstrap_intervals(
+                x, y, resamples, rng
+            )
+        for name, result in results.items():
+            statistics[name][columns, property_idx] = result[:, 0]
+
+    return GroupCorrelations(features=features, properties=properties, **statistics)
@@ -0,0 +1,170 @@
+import heapq
+from datetime import datetime
+from typing import NamedTuple
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import AnalysisRecord, Simulation
+from .scheduling import pick_analyses
+
+# most recent analyses the runtime model is fitted to
+HISTORY_SIZE = 200
+MIN_HISTORY = 5
+MODEL_CACHE_KEY = "runtime-model"
+MODEL_CACHE_TIMEOUT = 600
+
+
+class RuntimeModel(NamedTuple):
+    # seconds = constant + per_frame * frames + per_atom_frame * frames * atoms
+    constant: float
+    per_frame: float
+    per_atom_frame: float
+    # used for simulations prepared before atoms were counted
+    mean_atom_count: float
+    history_size: int
+
+    def predict(self, frame_count: int | None, atom_count: int | None) -> float:
+        frames = frame_count or 0
+        atoms = atom_count if atom_count is not None else self.mean_atom_count
+        seconds = (
+            self.constant
+            + self.per_frame * frames
+            + self.per_atom_frame * frames * atoms
+        )
+        return max(seconds, 0.0)
+
+
+class Estimate(NamedTuple):
+    # seconds from now, starts_in is 0 for running analyses
+    starts_in: float
+    finishes_in: float
+
+    def describe(self) -> str:
+        if self.starts_in > 0:
+            return (
+                f"starts in {format_duration(self.starts_in)}, "
+                f"done in {format_duration(self.finishes_in)}"
+            )
+        return f"done in {format_duration(self.finishes_in)}"
+
+
+def format_duration(seconds: float) -> str:
+    minutes = round(seconds / 60)
+    if minutes < 1:
+        return "< 1 min"
+    if minutes < 120:
+        return f"~{minutes} min"
+    return f"~{minutes / 60:.1f} h"
+
+
+def _features(frame_counts: np.ndarray, atom_counts: np.ndarray) -> np.ndarray:
+    return np.column_stack(
+        [np.ones(len(frame_counts)), frame_counts, frame_counts * atom_counts]
+    )
+
+
+def fit_runtime_model(records: list[AnalysisRecord]) -> RuntimeModel | None:
+    records = [record for record in records if record.atom_count is not None]
+    if len(records) < MIN_HISTORY:
+        return None
+    frame_counts = np.array([record.frame_count for record in records], dtype=float)
+    atom_counts = np.array([record.atom_count for record in records], dtype=float)
+    seconds = np.array([record.total_seconds for record in records])
+    coefficients, *_ = np.linalg.lstsq(
+        _features(frame_counts, atom_counts), seconds, rcond=None
+    )
+    return RuntimeModel(*coefficients.tolist(), float(atom_counts.mean()), len(records))
+
+
+def get_runtime_model() -> RuntimeModel | None:
+    """Model fitted to recent analyses that ran with the current worker threads."""
+    model = cache.get(MODEL_CACHE_KEY)
+    if model is None:
+        records = AnalysisRecord.objects.filter(
+            worker_threads=settings.MAX_THREADS_PER_WORKER
+        ).order_by("-created_at")[:HISTORY_SIZE]
+        model = fit_runtime_model(list(records))
+        # stored even when missing, so little history is not refitted on every call
+        cache.set(MODEL_CACHE_KEY, model or False, MODEL_CACHE_TIMEOUT)
+    return model or None
+
+
+def remaining_runtime(model: RuntimeModel, sim: Simulation, now: datetime) -> float:
+    predicted = model.predict(sim.frame_count, sim.atom_count)
+    if sim.started_at is None:
+        return predicted
+    elapsed = (now - sim.started_at).total_seconds()
+    if sim.frames_done > 0 and sim.frame_count:
+        # the analysis' own progress beats the history once PLIP reports frames
+        return elapsed * (sim.frame_count - sim.frames_done) / sim.frames_done
+    return max(predicted - elapsed, 0.0)
+
+
+def simulate_queue(
+    busy_for: list[float], durations: list[float], workers: int
+) -> list[tuple[float, float]]:
+    """Start and end of each job, jobs taken in order by the first free worker."""
+    free_at = sorted(busy_for)[:workers]
+    free_at += [0.0] * (workers - len(free_at))
+    heapq.heapify(free_at)
+    schedule = []
+    for duration in durations:
+        start = heapq.heappop(free_at)
+        schedule.append((start, start + duration))
+        heapq.heappush(free_at, start + duration)
+    return schedule
+
+
+def replay_arrivals(
+    arrivals: list[float], durations: list[float], workers: int
+) -> np.ndarray:
+    """Queue waits of jobs arriving at the given seconds, served first come first."""
+    free_at = [0.0] * workers
+    waits = []
+    for arrival, duration in sorted(zip(arrivals, durations)):
+        start = max(heapq.heappop(free_at), arrival)
+        waits.append(start - arrival)
+        heapq.heappush(free_at, start + duration)
+    return np.array(waits)
+
+
+def estimate_queue() -> dict[int, Estimate]:
+    """Estimates of every waiting and running analysis, by simulation pk.
+
+    Waiting simulations are taken in the order the scheduler would pick them now,
+    later picks may differ, as fair share depends on what runs at the time.
+    """
+    model = get_runtime_model()
+    if model is None:
+        return {}
+    now = timezone.now()
+    sims = list(
+        Simulation.objects.filter(
+            status__in=[
+                Simulation.Status.READY,
+                Simulation.Status.QUEUED,
+                Simulation.Status.RUNNING,
+            ]
+        )
+    )
+    in_flight = [sim for sim in sims if sim.is_running()]
+    waiting = [
+        sim
+        for sim in sims
+        if sim.status == Simulation.Status.READY and not sim.was_deleted
+    ]
+    estimates = {}
+    for sim in in_flight:
+        estimates[sim.pk] = Estimate(0.0, remaining_runtime(model, sim, now))
+    order = pick_analyses(waiting, in_flight, len(waiting), now)
+    schedule = simulate_queue(
+        [estimate.finishes_in for estimate in estimates.values()],
+        [model.predict(sim.frame_count, sim.atom_count) for sim in order],
+        settings.ANALYSIS_SLOTS,
+    )
+    for sim, (start, end) in zip(order, schedule):
+        estimates[sim.pk] = Estimate(start, end)
+    return estimates
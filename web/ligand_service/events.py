@@ -0,0 +1,87 @@
+import functools
+import json
+import threading
+import time
+from typing import Iterator
+
+import redis
+from django.conf import settings
+
+# a stream ends after this many seconds, the browser reconnects on its own
+STREAM_LIFETIME = 600
+KEEPALIVE_INTERVAL = 15
+# streams served at once by this process, each holds a thread
+_stream_slots = threading.BoundedSemaphore(settings.EVENT_STREAMS_PER_WORKER)
+
+
+def events_enabled() -> bool:
+    return settings.EVENTS_REDIS_URL is not None
+
+
+@functools.cache
+def get_redis() -> redis.Redis:
+    return redis.Redis.from_url(settings.EVENTS_REDIS_URL)
+
+
+def _channel(user_key: str) -> str:
+    return f"sim-events:{user_key}"
+
+
+def publish_simulation(sim) -> None:
+    """Sends the current status of a simulation to dashboards of its owner."""
+    if not events_enabled():
+        return
+    event = {
+        "simId": str(sim.sim_id),
+        "state": sim.status,
+        "status": sim.get_analysis_status(),
+        "wasDeleted": sim.was_deleted,
+    }
+    try:
+        get_redis().publish(_channel(sim.user_key), json.dumps(event))
+    except redis.RedisError as e:
+        # dashboards catch up on their next full refresh
+        print(f"Failed to publish simulation event: {e}", flush=True)
+
+
+def stream_simulation_events(user_key: str) -> Iterator[str]:
+    """Server-sent events with status changes of the user's simulations."""
+    pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(_channel(user_key))
+    try:
+        yield f"retry: {KEEPALIVE_INTERVAL * 1000}\n\n"
+        end = time.monotonic() + STREAM_LIFETIME
+        while time.monotonic() < end:
+            message = pubsub.get_message(timeout=KEEPALIVE_INTERVAL)
+            if message is None:
+                # keeps proxies from closing an idle connection
+                yield ": keepalive\n\n"
+                continue
+            yield f"data: {message['data'].decode()}\n\n"
+    finally:
+        pubsub.close()
+
+
+class EventStream:
+    """Server-sent events of a user, frees its slot when the response is closed."""
+
+    def __init__(self, user_key: str):
+        self.events = stream_simulation_events(user_key)
+        self.closed = False
+
+    def __iter__(self) -> Iterator[str]:
+        return self.events
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.events.close()
+        _stream_slots.release()
+
+
+def open_event_stream(user_key: str) -> EventStream | None:
+    """Returns None, when this process already serves as many streams as allowed."""
+    if not _stream_slots.acquire(blocking=False):
+        return None
+    return EventStream(user_key)
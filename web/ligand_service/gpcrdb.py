@@ -0,0 +1,120 @@
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from .models import GPCRdbResidueAPI
+
+RESIDUES_EXTENDED_PATH = "/services/residues/extended/"
+# (connect, read) timeouts in seconds
+REQUEST_TIMEOUT = (5, settings.GPCRDB_TIMEOUT)
+# a worker waiting for another worker's request gives up after this many seconds
+FETCH_LOCK_TIMEOUT = 2 * settings.GPCRDB_TIMEOUT
+FETCH_POLL_INTERVAL = 0.5
+RESIDUES_CACHE_SIZE = 256
+
+
+class GPCRdbError(Exception):
+    pass
+
+
+@functools.cache
+def get_session() -> requests.Session:
+    """HTTP session shared by all threads of the process, keeps connections alive."""
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+    )
+    adapter = HTTPAdapter(
+        max_retries=retry, pool_maxsize=settings.GPCRDB_MAX_CONCURRENT_REQUESTS
+    )
+    session = requests.Session()
+    session.headers["accept"] = "application/json"
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_residues(uniprot_identifier: str) -> list[dict[Any, Any]]:
+    url = settings.GPCRDB_URL + RESIDUES_EXTENDED_PATH + uniprot_identifier
+    print(f"Calling GPCRdb: {url}", flush=True)
+    try:
+        response = get_session().get(url, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException as e:
+        raise GPCRdbError(f"Call failed: {e}") from e
+    if not response.ok:
+        raise GPCRdbError(f"Call failed: {response.status_code}")
+    print("Call successful", flush=True)
+    return response.json()
+
+
+def _stored_residues(uniprot_identifier: str) -> list[dict[Any, Any]] | None:
+    stored = GPCRdbResidueAPI.objects.filter(
+        uniprot_identifier=uniprot_identifier
+    ).first()
+    return stored.response_json if stored is not None else None
+
+
+@functools.lru_cache(maxsize=RESIDUES_CACHE_SIZE)
+def _get_residues(uniprot_identifier: str) -> list[dict[Any, Any]]:
+    # only one worker calls GPCRdb for an identifier, the others wait for its result
+    lock_key = f"gpcrdb-residues-{uniprot_identifier}"
+    deadline = time.monotonic() + FETCH_LOCK_TIMEOUT
+    while True:
+        residues = _stored_residues(uniprot_identifier)
+        if residues is not None:
+            return residues
+        if cache.add(lock_key, True, timeout=FETCH_LOCK_TIMEOUT):
+            try:
+                residues = fetch_residues(uniprot_identifier)
+                GPCRdbResidueAPI.objects.get_or_create(
+                    uniprot_identifier=uniprot_identifier,
+                    defaults={"response_json": residues},
+                )
+                return residues
+            finally:
+                cache.delete(lock_key)
+        if time.monotonic() > deadline:
+            raise GPCRdbError(f"Timed out waiting for {uniprot_identifier}")
+        time.sleep(FETCH_POLL_INTERVAL)
+
+
+def get_residues(uniprot_identifier: str) -> list[dict[Any, Any]] | None:
+    """Residues of a receptor from the process cache, the database or GPCRdb."""
+    try:
+        return _get_residues(uniprot_identifier)
+    except GPCRdbError as e:
+        # failures are not cached, the next analysis tries again
+        print(f"Failed to get residues of {uniprot_identifier}: {e}", flush=True)
+        return None
+
+
+def _get_residues_in_thread(uniprot_identifier: str) -> list[dict[Any, Any]] | None:
+    try:
+        return get_residues(uniprot_identifier)
+    finally:
+        # every thread opens its own database connection
+        connections.close_all()
+
+
+def get_residues_many(
+    uniprot_identifiers: list[str],
+) -> dict[str, list[dict[Any, Any]] | None]:
+    if len(uniprot_identifiers) == 0:
+        return {}
+    workers = min(len(uniprot_identifiers), settings.GPCRDB_MAX_CONCURRENT_REQUESTS)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(
+            zip(
+                uniprot_identifiers,
+                executor.map(_get_residues_in_thread, uniprot_identifiers),
+            )
+        )
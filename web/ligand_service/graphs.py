@@ -3,6 +3,8 @@ import pandas as pd
 import plotly.graph_objects as go
 import numpy as np
 
+from .correlations import GroupCorrelations
+
 PAGE_BG_COLOR = "#e5e7eb"
 COMMON_LAYOUT = dict(margin=dict(l=0, r=0, t=0, b=0), paper_bgcolor=PAGE_BG_COLOR)
 COMMON_LAYOUT_TABLE = dict(
@@ -42,14 +44,15 @@ def create_getcontacts_table(get_contacts_df: pd.DataFrame) -> str:
     return table
 
 
-def create_interaction_area_graph(contacts_df: pd.DataFrame) -> str:
-    print(contacts_df.columns.values, flush=True)
-    interaction_count = (
+def count_interactions(contacts_df: pd.DataFrame) -> pd.DataFrame:
+    return (
         contacts_df.groupby(["Frame", "Interaction type"])
         .agg(Count=("Residue number", "count"))
         .reset_index()
     )
-    print(interaction_count, flush=True)
+
+
+def plot_interaction_counts(interaction_count: pd.DataFrame) -> str:
     fig = px.area(
         interaction_count,
         x="Frame",
@@ -68,6 +71,13 @@ def create_interaction_area_graph(contacts_df: pd.DataFrame) -> str:
     return graph
 
 
+def create_interaction_area_graph(contacts_df: pd.DataFrame) -> str:
+    print(contacts_df.columns.values, flush=True)
+    interaction_count = count_interactions(contacts_df)
+    print(interaction_count, flush=True)
+    return plot_interaction_counts(interaction_count)
+
+
 def hex2rgba(hexcol, a):
     return f"rgba({int(hexcol[1:3], 16)},{int(hexcol[3:5], 16)},{int(hexcol[5:7], 16)},{a})"
 
@@ -199,6 +209,16 @@ def create_time_resolved_map(contacts_df: pd.DataFrame) -> str:
     return graph
 
 
+ALL_TYPES = "All types"
+CONTACT_SUMMARY_COLUMNS = [
+    "ResidueLabel",
+    "Interaction type",
+    "Frames with contact",
+    "Interaction count",
+    "Total frames",
+]
+
+
 def _reslabel(name, num):
     return f"{name}-{num}"
 
@@ -210,69 +230,122 @@ def _resnum_key(label):
         return 1e9
 
 
-def contact_fraction_matrix(
-    group_df: pd.DataFrame, itype: str | None = None
-) -> pd.DataFrame:
-    df = group_df.copy()
-
-    df["ResidueLabel"] = [
-        _reslabel(rn, rr) for rn, rr in zip(df["Residue name"], df["Residue number"])
-    ]
-    total_frames = (
-        df.groupby("Simulation name")["Frame"].nunique().rename("total_frames")
+def _residue_labels(contacts_df: pd.DataFrame) -> pd.Categorical:
+    codes, residues = pd.MultiIndex.from_arrays(
+        [contacts_df["Residue name"], contacts_df["Residue number"]]
+    ).factorize()
+    # labels are formatted once per residue, not once per interaction
+    return pd.Categorical.from_codes(
+        codes, categories=[_reslabel(rn, rr) for rn, rr in residues]
     )
 
-    if itype is not None:
-        df = df[df["Interaction type"] == itype]
 
-    df["Frame"] = pd.to_numeric(df["Frame"], errors="coerce")
-    df = df.dropna(subset=["Frame", "Simulation name", "ResidueLabel"])
+def summarise_contacts(contacts_df: pd.DataFrame) -> pd.DataFrame:
+    """Summarises contacts of a single simulation per residue and interaction type.
 
-    pres = (
-        df[["Simulation name", "ResidueLabel", "Frame"]]
-        .drop_duplicates()
-        .groupby(["Simulation name", "ResidueLabel"])
-        .agg(frames_with_contact=("Frame", "nunique"))
+    The summary holds everything group analyses need from a simulation, rows with
+    interaction type "All types" count frames with any contact of the residue.
+    """
+    df = pd.DataFrame(
+        {
+            "ResidueLabel": _residue_labels(contacts_df),
+            "Interaction type": contacts_df["Interaction type"].astype("category"),
+            "Frame": pd.to_numeric(contacts_df["Frame"], errors="coerce"),
+        }
+    )
+    total_frames = contacts_df["Frame"].nunique()
+    df = df.dropna(subset=["Frame", "ResidueLabel"])
+
+    aggregations = {
+        "Frames with contact": ("Frame", "nunique"),
+        "Interaction count": ("Frame", "count"),
+    }
+    by_type = (
+        df.groupby(["ResidueLabel", "Interaction type"], observed=True)
+        .agg(**aggregations)
         .reset_index()
     )
+    all_types = (
+        df.groupby("ResidueLabel", observed=True).agg(**aggregations).reset_index()
+    )
+    all_types["Interaction type"] = ALL_TYPES
 
-    pres = pres.merge(total_frames, on="Simulation name", how="left")
-
-    pres["FractionPercent"] = 100.0 * pres["frames_with_contact"] / pres["total_frames"]
-
-    mat = pres.pivot(
-        index="Simulation name", columns="ResidueLabel", values="FractionPercent"
-    ).fillna(0.0)
+    summary_df = pd.concat(
+        [all_types, by_type.astype({"Interaction type": str})], ignore_index=True
+    )
+    summary_df["ResidueLabel"] = summary_df["ResidueLabel"].astype(str)
+    summary_df["Total frames"] = total_frames
+    return summary_df[CONTACT_SUMMARY_COLUMNS]
 
-    mat = mat[sorted(mat.columns, key=_resnum_key)]
 
-    return mat
+def merge_contact_summaries(
+    summary_df: pd.DataFrame, other_df: pd.DataFrame
+) -> pd.DataFrame:
+    """Merges summaries of two disjoint sets of frames of the same simulation."""
+    total_frames = sum(
+        int(df["Total frames"].iloc[0]) for df in (summary_df, other_df) if len(df)
+    )
+    merged_df = (
+        pd.concat([summary_df, other_df], ignore_index=True)
+        .groupby(["ResidueLabel", "Interaction type"], sort=False)[
+            ["Frames with contact", "Interaction count"]
+        ]
+        .sum()
+        .reset_index()
+    )
+    merged_df["Total frames"] = total_frames
+    return merged_df[CONTACT_SUMMARY_COLUMNS]
+
+
+def contact_fraction_tensor(
+    summary_df: pd.DataFrame,
+) -> tuple[list[str], list[str], list[str], np.ndarray]:
+    """Contact fractions in percent as interaction types × simulations × residues.
+
+    The first interaction type is "All types", simulations are sorted by name and
+    residues by their number.
+    """
+    types = [ALL_TYPES] + sorted(
+        t
+        for t in pd.unique(summary_df["Interaction type"])
+        if pd.notna(t) and t != ALL_TYPES
+    )
+    sims = sorted(pd.unique(summary_df["Simulation name"]))
+    residues = sorted(pd.unique(summary_df["ResidueLabel"]), key=_resnum_key)
+
+    fractions = np.zeros((len(types), len(sims), len(residues)))
+    fractions[
+        pd.Categorical(summary_df["Interaction type"], categories=types).codes,
+        pd.Categorical(summary_df["Simulation name"], categories=sims).codes,
+        pd.Categorical(summary_df["ResidueLabel"], categories=residues).codes,
+    ] = (100.0 * summary_df["Frames with contact"] / summary_df["Total frames"]).values
+    return types, sims, residues, fractions
+
+
+def _heatmap_dropdown(buttons: list[dict]) -> dict:
+    return dict(
+        type="dropdown",
+        buttons=buttons,
+        x=1.02,
+        y=1.15,
+        xanchor="left",
+        yanchor="top",
+        bgcolor=PAGE_BG_COLOR,
+        bordercolor="lightgray",
+    )
 
 
 def plot_contact_fraction_heatmap(
-    group_df: pd.DataFrame,
+    summary_df: pd.DataFrame,
     title_prefix: str = "Contact fraction per residue",
     colorscale: str = "magma_r",
 ):
-    types = [t for t in pd.unique(group_df["Interaction type"]) if pd.notna(t)]
-    types_sorted = sorted(types)
-
-    mats = {"All types": contact_fraction_matrix(group_df, None)}
-    for t in types_sorted:
-        mats[t] = contact_fraction_matrix(group_df, t)
-
-    all_sims = sorted(set().union(*[set(m.index) for m in mats.values()]))
-    all_res = sorted(
-        set().union(*[set(m.columns) for m in mats.values()]), key=_resnum_key
-    )
+    types, sims, residues, fractions = contact_fraction_tensor(summary_df)
 
-    for k in mats:
-        mats[k] = mats[k].reindex(index=all_sims, columns=all_res, fill_value=0.0)
-
-    init_key = "All types"
-    Z0 = mats[init_key].values
-    X = all_res
-    Y = all_sims
+    init_key = ALL_TYPES
+    Z0 = fractions[0]
+    X = residues
+    Y = sims
 
     fig = go.Figure(
         data=go.Heatmap(
@@ -303,13 +376,13 @@ def plot_contact_fraction_heatmap(
     )
 
     buttons = []
-    for key in [init_key] + types_sorted:
+    for key, type_fractions in zip(types, fractions):
         buttons.append(
             dict(
                 label=key,
                 method="update",
                 args=[
-                    {"z": [mats[key].values]},
+                    {"z": [type_fractions]},
                     {"title": {"text": f"{title_prefix} — {key}"}},
                 ],
             )
@@ -317,20 +390,7 @@ def plot_contact_fraction_heatmap(
 
     fig.update_xaxes(tickangle=45)
 
-    fig.update_layout(
-        updatemenus=[
-            dict(
-                type="dropdown",
-                buttons=buttons,
-                x=1.02,
-                y=1.15,
-                xanchor="left",
-                yanchor="top",
-                bgcolor=PAGE_BG_COLOR,
-                bordercolor="lightgray",
-            )
-        ]
-    )
+    fig.update_layout(updatemenus=[_heatmap_dropdown(buttons)])
 
     fig_html = fig.to_html(
         include_plotlyjs=False,
@@ -340,80 +400,66 @@ def plot_contact_fraction_heatmap(
     return fig_html
 
 
-IDENTIFIER_COLUMN = "Simulation name"
+STATISTIC_NAMES = {"pearson": "Pearson", "spearman": "Spearman"}
+CORRELATION_HOVER = (
+    "Residue: %{x}<br>"
+    "Correlation: %{z:.3f}<br>"
+    "Permutation p-value: %{customdata[0]:.3g}"
+)
+# bootstrap intervals are computed for Pearson correlations only
+CORRELATION_HOVERS = {
+    "pearson": CORRELATION_HOVER
+    + "<br>95% CI: %{customdata[1]:.3f} to %{customdata[2]:.3f}<extra></extra>",
+    "spearman": CORRELATION_HOVER + "<extra></extra>",
+}
 
 
-def plot_correlation_covariance_heatmaps(
-    df: pd.DataFrame,
-    colorscale: str = "magma_r",
-):
-    sims_exp_data = df[df.columns[-3:]].drop_duplicates().reset_index(drop=True)
-    sims_frame_data = df[df.columns[:-3].to_list() + [IDENTIFIER_COLUMN]]
-    sims_frame_data["residue"] = (
-        sims_frame_data["Residue name"]
-        + "-"
-        + sims_frame_data["Residue number"].astype(str)
+def _correlation_frame(
+    correlations: GroupCorrelations, statistic: str, property_name: str
+) -> pd.DataFrame:
+    df = correlations.frame(statistic, property_name).rename(
+        index={ALL_TYPES: "Overall"}
     )
+    types = ["Overall"] + sorted(t for t in df.index if t != "Overall")
+    return df.reindex(index=types, columns=sorted(df.columns, key=_resnum_key))
 
-    interactions_by_sim = (
-        sims_frame_data.groupby([IDENTIFIER_COLUMN, "Interaction type"])["Frame"]
-        .count()
-        .reset_index()
-    )
-    interactions_by_sim_residue = (
-        sims_frame_data.groupby([IDENTIFIER_COLUMN, "residue"])["Frame"]
-        .count()
-        .reset_index()
-    )
-    interactions_by_sim_residue_type = (
-        sims_frame_data.groupby([IDENTIFIER_COLUMN, "residue", "Interaction type"])[
-            "Frame"
-        ]
-        .count()
-        .reset_index()
-    )
 
-    interactions_with_exp = interactions_by_sim.merge(sims_exp_data.iloc[:, :-1])
-    EXP_DATA_COLUMN = interactions_with_exp.columns.to_list()[-1]
+def plot_correlation_covariance_heatmaps(
+    correlations: GroupCorrelations,
+    colorscale: str = "rdylbu_r",
+):
+    corr_views = {}
+    for property_name in correlations.properties:
+        for statistic, statistic_name in STATISTIC_NAMES.items():
+            significance = np.stack(
+                [
+                    _correlation_frame(correlations, name, property_name).values
+                    for name in (
+                        f"{statistic}_pvalue",
+                        f"{statistic}_ci_low",
+                        f"{statistic}_ci_high",
+                    )
+                ],
+                axis=-1,
+            )
+            corr_views[f"{statistic_name} — {property_name}"] = (
+                _correlation_frame(correlations, statistic, property_name),
+                significance,
+                f"{statistic_name} correlation between number of interactions and {property_name}",
+                CORRELATION_HOVERS[statistic],
+            )
 
-    correlations = {}
-    wide_df = interactions_by_sim_residue.pivot_table(
-        index=["Simulation name"], columns="residue", values="Frame"
-    ).reset_index()
-    wide_df = wide_df.merge(sims_exp_data.iloc[:, :-1])
-    corrs = wide_df.corr(numeric_only=True)[EXP_DATA_COLUMN].sort_values(
-        ascending=False
+    init_corrs_df, init_significance, init_corr_title, init_hover = next(
+        iter(corr_views.values())
     )
-    correlations["Overall"] = corrs
-
-    for interaction in interactions_by_sim_residue_type["Interaction type"].unique():
-        wide_df = (
-            interactions_by_sim_residue_type[
-                interactions_by_sim_residue_type["Interaction type"] == interaction
-            ]
-            .pivot_table(index=["Simulation name"], columns="residue", values="Frame")
-            .reset_index()
-        )
-        wide_df = wide_df.merge(sims_exp_data.iloc[:, :-1])
-        corrs = wide_df.corr(numeric_only=True)[EXP_DATA_COLUMN].sort_values(
-            ascending=False
-        )
-        corrs.drop(EXP_DATA_COLUMN, inplace=True)
-        correlations[interaction] = corrs
-
-    corrs_df = pd.DataFrame(correlations)
-    corrs_df.drop(EXP_DATA_COLUMN, inplace=True)
-    corrs_df.sort_index(key=lambda x: x.str.split("-").str[1].astype(int), inplace=True)
-    corrs_df.fillna("", inplace=True)
-
     fig_corr = go.Figure(
         data=go.Heatmap(
-            z=corrs_df.T.values,
-            x=corrs_df.index,
-            y=corrs_df.columns.to_list(),
+            z=init_corrs_df.values,
+            x=init_corrs_df.columns,
+            y=init_corrs_df.index.to_list(),
             zmin=-1,
             zmax=1,
-            colorscale="rdylbu_r",
+            colorscale=colorscale,
             colorbar=dict(
                 title=dict(
                     text="Correlation",
@@ -422,16 +468,36 @@ def plot_correlation_covariance_heatmaps(
                 tickfont=dict(size=10),
                 xpad=10,
             ),
-            hovertemplate="Residue: %{x}<br>Correlation: %{z}<extra></extra>",
+            customdata=init_significance,
+            hovertemplate=init_hover,
         )
     )
 
     fig_corr.update_layout(
         paper_bgcolor=PAGE_BG_COLOR,
-        title=f"Correlation between number of interactions and {EXP_DATA_COLUMN}",
+        title=init_corr_title,
         xaxis_title="Residue",
         yaxis_title="Interaction type",
         xaxis=dict(tickangle=270),
+        updatemenus=[
+            _heatmap_dropdown(
+                [
+                    dict(
+                        label=label,
+                        method="update",
+                        args=[
+                            {
+                                "z": [df.values],
+                                "customdata": [significance],
+                                "hovertemplate": [hover],
+                            },
+                            {"title": {"text": title}},
+                        ],
+                    )
+                    for label, (df, significance, title, hover) in corr_views.items()
+                ]
+            )
+        ],
     )
 
     fig_corr.update_xaxes(tickangle=45)
@@ -442,40 +508,23 @@ def plot_correlation_covariance_heatmaps(
         config={"displaylogo": False, "responsive": True},
     )
 
-    covariances = {}
-    print(wide_df, flush=True)
-    covs = wide_df.cov(numeric_only=True)[EXP_DATA_COLUMN].sort_values(ascending=False)
-    covariances["Overall"] = covs
-    print(covs, flush=True)
-
-    for interaction in interactions_by_sim_residue_type["Interaction type"].unique():
-        wide_df = (
-            interactions_by_sim_residue_type[
-                interactions_by_sim_residue_type["Interaction type"] == interaction
-            ]
-            .pivot_table(index=["Simulation name"], columns="residue", values="Frame")
-            .reset_index()
-        )
-        wide_df = wide_df.merge(sims_exp_data.iloc[:, :-1])
-        covs = wide_df.cov(numeric_only=True)[EXP_DATA_COLUMN].sort_values(
-            ascending=False
+    cov_views = {
+        property_name: (
+            _correlation_frame(correlations, "covariance", property_name),
+            f"Covariance between number of interactions and {property_name}",
         )
-        covs.drop(EXP_DATA_COLUMN, inplace=True)
-        covariances[interaction] = covs
-
-    covs_df = pd.DataFrame(covariances)
-    covs_df.drop(EXP_DATA_COLUMN, inplace=True)
-    covs_df.sort_index(key=lambda x: x.str.split("-").str[1].astype(int), inplace=True)
-    covs_df.fillna("", inplace=True)
+        for property_name in correlations.properties
+    }
 
+    init_covs_df, init_cov_title = next(iter(cov_views.values()))
     fig_cov = go.Figure(
         data=go.Heatmap(
-            z=covs_df.T.values,
-            x=covs_df.index,
-            y=covs_df.columns.to_list(),
-            zmin=covs_df.min(numeric_only=True).min(),
-            zmax=covs_df.max(numeric_only=True).max(),
-            colorscale="rdylbu_r",
+            z=init_covs_df.values,
+            x=init_covs_df.columns,
+            y=init_covs_df.index.to_list(),
+            zmin=np.nanmin(init_covs_df.values),
+            zmax=np.nanmax(init_covs_df.values),
+            colorscale=colorscale,
             colorbar=dict(
                 title=dict(
                     text="Covariance",
@@ -490,10 +539,29 @@ def plot_correlation_covariance_heatmaps(
 
     fig_cov.update_layout(
         paper_bgcolor=PAGE_BG_COLOR,
-        title=f"Covariance between number of interactions and {EXP_DATA_COLUMN}",
+        title=init_cov_title,
         xaxis_title="Residue",
         yaxis_title="Interaction type",
         xaxis=dict(tickangle=270),
+        updatemenus=[
+            _heatmap_dropdown(
+                [
+                    dict(
+                        label=label,
+                        method="update",
+                        args=[
+                            {
+                                "z": [df.values],
+                                "zmin": [np.nanmin(df.values)],
+                                "zmax": [np.nanmax(df.values)],
+                            },
+                            {"title": {"text": title}},
+                        ],
+                    )
+                    for label, (df, title) in cov_views.items()
+                ]
+            )
+        ],
     )
 
     fig_cov.update_xaxes(tickangle=45)
@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ligand_service.estimation import get_runtime_model, replay_arrivals
+from ligand_service.models import AnalysisRecord
+
+STAGES = ["extraction", "plip", "numbering", "aggregation"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays analyses of the last days with different WORKER_COUNT values, "
+        "reports utilisation and queue wait"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=30)
+        parser.add_argument("--max-workers", type=int, default=8)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        since = now - timedelta(days=options["days"])
+        records = list(
+            AnalysisRecord.objects.filter(
+                created_at__gte=since, simulation__queued_at__isnull=False
+            ).select_related("simulation")
+        )
+        if len(records) == 0:
+            self.stdout.write("No analyses recorded in this period")
+            return
+
+        model = get_runtime_model()
+        if model is not None:
+            self.stdout.write(
+                f"Runtime model from {model.history_size} analyses: "
+                f"{model.constant:.1f} s + {model.per_frame:.3f} s / frame "
+                f"+ {model.per_atom_frame:.3g} s / (frame × atom)"
+            )
+        total = sum(record.total_seconds for record in records)
+        stage_seconds = {
+            stage: sum(getattr(record, f"{stage}_seconds") for record in records)
+            for stage in STAGES
+        }
+        shares = ", ".join(
+            f"{stage} {100 * seconds / total:.0f}%"
+            for stage, seconds in stage_seconds.items()
+        )
+        self.stdout.write(f"{len(records)} analyses, time spent in {shares}")
+
+        arrivals = [
+            (record.simulation.queued_at - since).total_seconds() for record in records
+        ]
+        durations = [record.total_seconds for record in records]
+        period = (now - since).total_seconds()
+        for workers in range(1, options["max_workers"] + 1):
+            waits = replay_arrivals(arrivals, durations, workers)
+            p50, p95 = np.percentile(waits, [50, 95])
+            current = " (current)" if workers == settings.ANALYSIS_SLOTS else ""
+            self.stdout.write(
+                f"WORKER_COUNT={workers}{current}: "
+                f"utilisation {100 * total / (workers * period):.0f}%, "
+                f"queue wait p50 {timedelta(seconds=round(p50))}, "
+                f"p95 {timedelta(seconds=round(p95))}"
+            )
@@ -1,4 +1,5 @@
 import csv
+import os
 import shutil
 from time import sleep
 from datetime import datetime
@@ -20,6 +21,7 @@ from ligand_service.utils import (
 
 EXAMPLE_USER_UUID = "7a872fc4-2f2d-4170-a5d6-f5d8944b3f87"
 EXAMPLE_GROUP_UUID = "6eb09d37-a6bd-41b2-b69f-e7126aae0e26"
+EXAMPLE_WORKER_COUNT = 8
 
 DIRNAME_TO_EXP_VALUE = {
     "Alvimopan": 2608.88,
@@ -73,30 +75,38 @@ class Command(BaseCommand):
                 exist_ok=True, parents=True
             )
             (get_user_results_dir(sim.results_id)).mkdir(exist_ok=True, parents=True)
-            views.start_sim_task(sim, EXAMPLE_USER_UUID)
+            views.start_sim_task(sim)
 
         sims = Simulation.objects.filter(user_key=EXAMPLE_USER_UUID)
 
         # start plip worker
         workers = []
-        for i in range(8):
+        # the scheduler hands out as many analyses as there are workers
+        worker_env = {**os.environ, "WORKER_COUNT": str(EXAMPLE_WORKER_COUNT)}
+        for i in range(EXAMPLE_WORKER_COUNT):
             worker = sb.Popen(
                 [
                     "python",
                     "manage.py",
                     "run_huey",
-                ]
+                ],
+                env=worker_env,
             )
             workers.append(worker)
+        workers.append(
+            sb.Popen(["python", "manage.py", "run_preparation_huey"], env=worker_env)
+        )
 
         toc = datetime.now()
         while True:
             tic = datetime.now()
+            # status is stored on the simulations, so they are fetched again
+            sims = Simulation.objects.filter(user_key=EXAMPLE_USER_UUID)
             status_list = [sim.get_analysis_status() for sim in sims]
             print(f"Elapsed time: {tic - toc} Current state: {status_list}")
-            if all([status == "Finished" for status in status_list]):
+            if all([sim.is_finished() for sim in sims]):
                 break
-            if any([status == "Failed" for status in status_list]):
+            if any([sim.has_failed() for sim in sims]):
                 raise CommandError("Simulation analysis failed!")
             sleep(5)
 
@@ -0,0 +1,21 @@
+import subprocess as sb
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ligand_service.contacts import GPCRDB_RESIDUES_BUNDLE_PATH
+
+
+class Command(BaseCommand):
+    help = "Downloads residues of all GPCRdb receptors into the local residue bundle"
+
+    def handle(self, *args, **options):
+        job = sb.run([sys.executable, "setup/getresidues.py"])
+        if job.returncode != 0:
+            raise CommandError("Refreshing the GPCRdb residue bundle failed!")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Residue bundle refreshed: {GPCRDB_RESIDUES_BUNDLE_PATH}, "
+                "restart the workers to use it"
+            )
+        )
@@ -0,0 +1,24 @@
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from huey.consumer_options import ConsumerConfig
+
+
+class Command(BaseCommand):
+    help = "Runs the consumer of the simulation preparation queue"
+
+    def handle(self, *args, **options):
+        # registers the preparation tasks
+        from ligand_service import tasks  # noqa: F401
+        from ligand_service.preparation import preparation_huey
+
+        config = ConsumerConfig(**settings.PREPARATION_HUEY["consumer"])
+        config.validate()
+        logger = logging.getLogger("huey")
+        if not logger.handlers:
+            config.setup_logger(logger)
+        # worker processes are forked, each opens its own database connection
+        connections.close_all()
+        preparation_huey.create_consumer(**config.values).run()
@@ -0,0 +1,46 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ligand_service.models import Simulation
+from ligand_service.scheduling import analysis_cost, queue_wait_percentiles
+
+
+class Command(BaseCommand):
+    help = "Reports p50 / p95 queue wait of analyses started in the last days"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=7)
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=options["days"])
+        sims = list(
+            Simulation.objects.filter(started_at__gte=since, queued_at__isnull=False)
+        )
+        groups = {
+            "All": sims,
+            "High priority": [
+                sim for sim in sims if sim.priority == Simulation.Priority.HIGH
+            ],
+            "Small": [
+                sim
+                for sim in sims
+                if analysis_cost(sim) <= settings.SCHEDULER_SMALL_JOB_COST
+            ],
+            "Large": [
+                sim
+                for sim in sims
+                if analysis_cost(sim) > settings.SCHEDULER_SMALL_JOB_COST
+            ],
+        }
+        for name, group in groups.items():
+            percentiles = queue_wait_percentiles(group)
+            if percentiles is None:
+                self.stdout.write(f"{name}: no analyses started")
+                continue
+            self.stdout.write(
+                f"{name}: {len(group)} analyses, "
+                f"p50 {percentiles[50]}, p95 {percentiles[95]}"
+            )
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-19 12:00
+
+import django_prometheus.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ligand_service', '0022_alter_simulation_topology_file_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChainNumbering',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence_hash', models.CharField(max_length=64, unique=True)),
+                ('uniprot_identifier', models.CharField(max_length=32)),
+                ('accession', models.CharField(max_length=16)),
+                ('evalue', models.FloatField()),
+                ('numbering', models.JSONField()),
+            ],
+            bases=(django_prometheus.models.ExportModelOperationsMixin('chain_numbering'), models.Model),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-19 12:30
+
+from django.db import migrations, models
+
+
+def remove_duplicate_responses(apps, schema_editor):
+    GPCRdbResidueAPI = apps.get_model('ligand_service', 'GPCRdbResidueAPI')
+    seen = set()
+    for response in GPCRdbResidueAPI.objects.order_by('id'):
+        if response.uniprot_identifier in seen:
+            response.delete()
+        else:
+            seen.add(response.uniprot_identifier)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ligand_service', '0023_chainnumbering'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_responses, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='gpcrdbresidueapi',
+            name='uniprot_identifier',
+            field=models.CharField(max_length=12, unique=True),
+        ),
+    ]
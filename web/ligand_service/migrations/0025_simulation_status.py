@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ligand_service', '0024_gpcrdbresidueapi_unique_uniprot_identifier'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='simulation',
+            name='status',
+            field=models.CharField(choices=[('Preparing', 'Preparing'), ('Invalid files', 'Invalid files'), ('Too many frames', 'Too many frames'), ('Ready', 'Ready')], default='Ready', max_length=32),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.4 on 2026-10-19 13:30
+
+from django.conf import settings
+from django.db import migrations, models
+from huey.contrib.djhuey import HUEY
+from huey.exceptions import TaskException
+
+
+def set_analysis_status(apps, schema_editor):
+    # status used to be read from huey results, finished analyses left run_data.json
+    Simulation = apps.get_model('ligand_service', 'Simulation')
+    for sim in Simulation.objects.filter(status='Ready', analysis_task_id__isnull=False):
+        uploads_dir = settings.BASE_DIR / 'user_uploads'
+        if (uploads_dir / str(sim.results_id) / 'run_data.json').is_file():
+            sim.status = 'Finished'
+        else:
+            try:
+                # no result yet, the task is still queued or running
+                pending = HUEY.result(str(sim.analysis_task_id), preserve=True) is None
+            except TaskException:
+                pending = False
+            if not pending:
+                sim.status = 'Failure'
+            elif (uploads_dir / sim.user_key / 'work' / str(sim.sim_id) / 'plip').is_dir():
+                # settled by reap_stale_analyses, if its worker is gone
+                sim.status = 'Running'
+            else:
+                sim.status = 'Queued'
+        sim.save(update_fields=['status'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ligand_service', '0025_simulation_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='simulation',
+            name='frames_done',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='simulation',
+            name='status',
+            field=models.CharField(choices=[('Preparing', 'Preparing'), ('Invalid files', 'Invalid files'), ('Too many frames', 'Too many frames'), ('Ready', 'Ready'), ('Queued', 'Queued'), ('Running', 'Running'), ('Finished', 'Finished'), ('Failure', 'Failure')], default='Ready', max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='simulation',
+            name='user_key',
+            field=models.CharField(db_index=True, max_length=32),
+        ),
+        migrations.RunPython(set_analysis_status, migrations.RunPython.noop),
+    ]
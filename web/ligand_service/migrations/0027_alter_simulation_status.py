@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ligand_service', '0026_simulation_frames_done_alter_simulation_status_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='simulation',
+            name='status',
+            field=models.CharField(choices=[('Preparing', 'Preparing'), ('Invalid files', 'Invalid files'), ('Too many frames', 'Too many frames'), ('Ready', 'Ready'), ('Queued', 'Queued'), ('Running', 'Running'), ('Finished', 'Finished'), ('Failure', 'Failure'), ('Cancelled', 'Cancelled')], default='Ready', max_length=32),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-19 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ligand_service', '0027_alter_simulation_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='simulation',
+            name='atom_count',
+            field=models.IntegerField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='simulation',
+            name='priority',
+            field=models.IntegerField(choices=[(0, 'Normal'), (1, 'High')], default=0),
+        ),
+        migrations.AddField(
+            model_name='simulation',
+            name='queued_at',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='simulation',
+            name='started_at',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-19 17:05
+
+import django.db.models.deletion
+import django_prometheus.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ligand_service', '0028_simulation_scheduling'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('frame_count', models.IntegerField()),
+                ('atom_count', models.IntegerField(default=None, null=True)),
+                ('pocket_size', models.IntegerField(default=None, null=True)),
+                ('worker_threads', models.IntegerField()),
+                ('queue_wait_seconds', models.FloatField(default=None, null=True)),
+                ('extraction_seconds', models.FloatField()),
+                ('plip_seconds', models.FloatField()),
+                ('numbering_seconds', models.FloatField()),
+                ('aggregation_seconds', models.FloatField()),
+                ('total_seconds', models.FloatField()),
+                ('simulation', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='ligand_service.simulation')),
+            ],
+            bases=(django_prometheus.models.ExportModelOperationsMixin('analysis_record'), models.Model),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 21:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ligand_service', '0029_analysisrecord'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='simulation',
+            name='heartbeat_at',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+    ]
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.conf import settings
 
 import uuid
@@ -7,9 +9,9 @@ from typing import NamedTuple
 
 from vmd import molecule
 from django_prometheus.models import ExportModelOperationsMixin
-from huey.contrib.djhuey import HUEY as huey
 
-from .utils import get_user_uploads_dir, get_user_work_dir
+from . import events
+from .utils import get_user_uploads_dir
 
 
 class TrajectoryFiles(NamedTuple):
@@ -41,16 +43,48 @@ def get_trajectory_frame_count(topology_file: Path, trajectory_file: Path) -> in
 
 
 class Simulation(ExportModelOperationsMixin("simulation"), models.Model):
+    class Status(models.TextChoices):
+        # set by the preparation task, finished uploads start as PREPARING
+        PREPARING = "Preparing"
+        INVALID_FILES = "Invalid files"
+        TOO_MANY_FRAMES = "Too many frames"
+        READY = "Ready"
+        # set when the analysis is queued and by huey signals of the analysis task
+        QUEUED = "Queued"
+        RUNNING = "Running"
+        FINISHED = "Finished"
+        FAILED = "Failure"
+        # the analysis was stopped, because the simulation was deleted or restarted
+        CANCELLED = "Cancelled"
+
+    class Priority(models.IntegerChoices):
+        NORMAL = 0
+        # uploaded by staff, scheduled before everything else
+        HIGH = 1
+
     created_at = models.DateTimeField(auto_now_add=True)
     dirname = models.CharField(max_length=128)
-    user_key = models.CharField(max_length=32)
+    user_key = models.CharField(max_length=32, db_index=True)
     analysis_task_id = models.UUIDField(null=True, default=None, unique=True)
     frame_count = models.IntegerField(null=True, default=None)
+    # updated by the analysis task while PLIP runs
+    frames_done = models.IntegerField(default=0)
+    # set by the preparation task, frames × atoms estimates the cost of the analysis
+    atom_count = models.IntegerField(null=True, default=None)
+    priority = models.IntegerField(choices=Priority.choices, default=Priority.NORMAL)
+    # waiting for the scheduler since, and handed to a worker at
+    queued_at = models.DateTimeField(null=True, default=None)
+    started_at = models.DateTimeField(null=True, default=None)
+    # last sign of life of the analysis, a killed worker sends no signal
+    heartbeat_at = models.DateTimeField(null=True, default=None)
     # internal, used for start / delete
     sim_id = models.UUIDField(null=True, default=uuid.uuid4, unique=True)
     # shared, used to find and share results
     results_id = models.UUIDField(null=True, default=uuid.uuid4, unique=True)
     was_deleted = models.BooleanField(default=False)
+    status = models.CharField(
+        max_length=32, choices=Status.choices, default=Status.READY
+    )
 
     topology_file = models.FilePathField(
         path=settings.BASE_DIR / "user_uploads",
@@ -68,63 +102,35 @@ class Simulation(ExportModelOperationsMixin("simulation"), models.Model):
     def __str__(self):
         return self.dirname
 
+    def is_in_queue(self) -> bool:
+        """Counts against MAXIMUM_UPLOADS_IN_QUEUE of the session."""
+        return not self.was_deleted and self.status in IN_QUEUE_STATUSES
+
     def is_not_queued(self) -> bool:
         return self.analysis_task_id is None
 
     def is_running(self) -> bool:
-        if self.analysis_task_id is None:
-            return False
-        try:
-            if huey.result(str(self.analysis_task_id), preserve=True) is None:
-                return True
-        except Exception:
-            return False
-        return False
+        return self.status in (Simulation.Status.QUEUED, Simulation.Status.RUNNING)
 
     def is_finished(self) -> bool:
-        if self.analysis_task_id is None:
-            return False
-        try:
-            if huey.result(str(self.analysis_task_id), preserve=True) is not None:
-                return True
-        except Exception:
-            return False
-        return False
-
-    def has_failed(self) -> bool | Exception:
-        if self.analysis_task_id is None:
-            return False
-        try:
-            if huey.result(str(self.analysis_task_id), preserve=True) is not None:
-                return False
-        except Exception as e:
-            return e
-        return False
-
-    # NOTE: Could be remade with huey signals, didn't notice them at the start!
+        return self.status == Simulation.Status.FINISHED
+
+    def has_failed(self) -> bool:
+        return self.status == Simulation.Status.FAILED
+
+    def is_cancelled(self) -> bool:
+        return self.status == Simulation.Status.CANCELLED
+
     def get_analysis_status(self) -> str:
-        if self.is_not_queued():
+        if self.was_deleted and self.is_running():
+            return "Deleted"
+        if self.status == Simulation.Status.READY:
             return "Queueing"
-        elif self.is_running():
-            # TODO: Add runinfo
-            if self.was_deleted:
-                return "Deleted"
-            files = self.get_trajectory_files()
-            if files is None:
-                return "Failure"
-            plip_dir = get_user_work_dir(self.user_key) / str(self.sim_id) / "plip"
-            if not plip_dir.is_dir():
-                return "Queued"
-            frames_done = len([x for x in plip_dir.iterdir()])
-            if frames_done == 0:
-                return "Queued"
-            return f"Running {frames_done} / {self.frame_count} frames"
-        elif self.has_failed():
-            return "Failure"
-        elif self.is_finished():
-            return "Finished"
-        else:
-            return "Unknown"
+        if self.status == Simulation.Status.RUNNING and self.frames_done > 0:
+            return f"Running {self.frames_done} / {self.frame_count} frames"
+        if self.status == Simulation.Status.RUNNING:
+            return "Queued"
+        return self.status
 
     def get_sim_dir(self) -> Path:
         return get_user_uploads_dir(self.user_key) / str(self.sim_id)
@@ -146,6 +152,19 @@ class Simulation(ExportModelOperationsMixin("simulation"), models.Model):
         return files
 
 
+IN_QUEUE_STATUSES = [
+    Simulation.Status.PREPARING,
+    Simulation.Status.READY,
+    Simulation.Status.QUEUED,
+    Simulation.Status.RUNNING,
+]
+
+
+@receiver(post_save, sender=Simulation)
+def publish_simulation_change(sender, instance: Simulation, **kwargs):
+    events.publish_simulation(instance)
+
+
 class GroupAnalysis(ExportModelOperationsMixin("group_analysis"), models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     user_key = models.CharField(max_length=32)
@@ -154,10 +173,41 @@ class GroupAnalysis(ExportModelOperationsMixin("group_analysis"), models.Model):
 
 
 class GPCRdbResidueAPI(ExportModelOperationsMixin("GPCRdb_calls"), models.Model):
-    uniprot_identifier = models.CharField(max_length=12)
+    uniprot_identifier = models.CharField(max_length=12, unique=True)
     response_json = models.JSONField()
 
 
+class ChainNumbering(ExportModelOperationsMixin("chain_numbering"), models.Model):
+    # sha256 of the chain sequence, its residue numbers and the receptor DB version
+    sequence_hash = models.CharField(max_length=64, unique=True)
+    uniprot_identifier = models.CharField(max_length=32)
+    accession = models.CharField(max_length=16)
+    evalue = models.FloatField()
+    # [residue_name, residue_number, *contacts.NUMBERING_COLUMNS] for every mapped
+    # residue, the rows of the numbering table without their chain
+    numbering = models.JSONField()
+
+
+class AnalysisRecord(ExportModelOperationsMixin("analysis_record"), models.Model):
+    """Timings of a finished analysis, history for runtime and queue estimates."""
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    simulation = models.ForeignKey(Simulation, null=True, on_delete=models.SET_NULL)
+    frame_count = models.IntegerField()
+    atom_count = models.IntegerField(null=True, default=None)
+    # residues in contact with ligands in any frame
+    pocket_size = models.IntegerField(null=True, default=None)
+    # PLIP instances the analysis ran with
+    worker_threads = models.IntegerField()
+    queue_wait_seconds = models.FloatField(null=True, default=None)
+    extraction_seconds = models.FloatField()
+    plip_seconds = models.FloatField()
+    # waiting for receptor numbering not done by the preparation task
+    numbering_seconds = models.FloatField()
+    aggregation_seconds = models.FloatField()
+    total_seconds = models.FloatField()
+
+
 def get_files_maestro(dir: Path) -> TrajectoryFiles | None:
     subdirs = [x for x in dir.rglob("*") if x.is_dir()]
     chosen_trj = None
@@ -0,0 +1,15 @@
+import huey
+from django.conf import settings
+
+
+def create_huey(config: dict) -> huey.Huey:
+    """Creates a huey instance from a config in the format of settings.HUEY."""
+    config = config.copy()
+    huey_class = getattr(huey, config.pop("huey_class").split(".")[-1])
+    config.pop("consumer", None)
+    config.update(config.pop("connection", {}))
+    return huey_class(config.pop("name"), **config)
+
+
+# separate from the analysis queue, so cheap preparation never waits behind analyses
+preparation_huey = create_huey(settings.PREPARATION_HUEY)
@@ -0,0 +1,84 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from enum import IntEnum
+
+import numpy as np
+from django.conf import settings
+
+from .models import Simulation
+
+
+class SchedulingClass(IntEnum):
+    LARGE = 0
+    SMALL = 1
+    # waited longer than SCHEDULER_AGING_MINUTES
+    AGED = 2
+    PRIORITY = 3
+
+
+def analysis_cost(sim: Simulation) -> int:
+    # PLIP time grows with the number of frames and the size of each frame
+    return (sim.frame_count or 0) * (sim.atom_count or 0)
+
+
+def waiting_since(sim: Simulation) -> datetime:
+    return sim.queued_at or sim.created_at
+
+
+def scheduling_class(sim: Simulation, now: datetime) -> SchedulingClass:
+    if sim.priority == Simulation.Priority.HIGH:
+        return SchedulingClass.PRIORITY
+    if now - waiting_since(sim) > timedelta(minutes=settings.SCHEDULER_AGING_MINUTES):
+        return SchedulingClass.AGED
+    if analysis_cost(sim) <= settings.SCHEDULER_SMALL_JOB_COST:
+        return SchedulingClass.SMALL
+    return SchedulingClass.LARGE
+
+
+def pick_analyses(
+    waiting: list[Simulation],
+    in_flight: list[Simulation],
+    slots: int,
+    now: datetime,
+) -> list[Simulation]:
+    """Picks up to `slots` waiting simulations to analyse next, in order.
+
+    Higher scheduling classes go first. Within a class the session with the least
+    work in flight wins, so one session can not take every worker, then the cheaper
+    analysis, then the one waiting longer.
+    """
+    session_cost = defaultdict(int)
+    for sim in in_flight:
+        session_cost[sim.user_key] += analysis_cost(sim)
+    classes = {sim.pk: scheduling_class(sim, now) for sim in waiting}
+
+    remaining = list(waiting)
+    picked = []
+    while remaining and len(picked) < slots:
+        sim = min(
+            remaining,
+            key=lambda s: (
+                -classes[s.pk],
+                session_cost[s.user_key],
+                analysis_cost(s),
+                waiting_since(s),
+            ),
+        )
+        remaining.remove(sim)
+        picked.append(sim)
+        session_cost[sim.user_key] += analysis_cost(sim)
+    return picked
+
+
+def queue_wait_percentiles(
+    sims: list[Simulation], percentiles: tuple[int, ...] = (50, 95)
+) -> dict[int, timedelta] | None:
+    waits = [
+        (sim.started_at - waiting_since(sim)).total_seconds()
+        for sim in sims
+        if sim.started_at is not None
+    ]
+    if len(waits) == 0:
+        return None
+    values = np.percentile(waits, percentiles)
+    return {p: timedelta(seconds=float(v)) for p, v in zip(percentiles, values)}
@@ -229,6 +229,11 @@ else:
         }
     }
 
+# pushes simulation updates to dashboards, without it the dashboards poll
+EVENTS_REDIS_URL = "redis://redis:6379/2" if RUNNING_IN_DOCKER else None
+# every stream holds a gunicorn thread for up to 10 minutes, the rest of the threads
+# stay free for other requests, GUNICORN_WORKERS × this many dashboards get events
+EVENT_STREAMS_PER_WORKER = load_int_from_env("EVENT_STREAMS_PER_WORKER", 16)
 
 if RUNNING_IN_DOCKER:
     HUEY = {
@@ -283,7 +288,40 @@ else:
         },
     }
 
+PREPARATION_HUEY = {
+    "huey_class": "huey.RedisHuey" if RUNNING_IN_DOCKER else "huey.SqliteHuey",
+    "name": f"{DATABASES['default']['NAME']}-preparation",
+    "results": False,  # Preparation tasks report through the database.
+    "immediate": False,
+    "utc": True,
+    "connection": (
+        {
+            "host": "redis",
+            "port": 6379,
+            "db": 0,
+            "read_timeout": 1,
+        }
+        if RUNNING_IN_DOCKER
+        else {}
+    ),
+    "consumer": {
+        "workers": load_int_from_env("PREPARATION_WORKERS", 2),
+        "worker_type": "process",  # VMD is not thread-safe.
+        "initial_delay": 0.1,
+        "backoff": 1.15,
+        "max_delay": 1.0,  # Picks up fresh uploads quickly.
+        "periodic": False,
+    },
+}
+
 MAX_THREADS_PER_WORKER = load_int_from_env("MAX_THREADS_PER_WORKER", 2)
+# analyses handed to huey at once, one per analysis worker, the rest wait for the
+# scheduler, so huey's FIFO queue never holds more than the workers can take
+ANALYSIS_SLOTS = load_int_from_env("WORKER_COUNT", 1)
+# frames × atoms, analyses up to this cost are scheduled before larger ones
+SCHEDULER_SMALL_JOB_COST = load_int_from_env("SCHEDULER_SMALL_JOB_COST", 20000000)
+# analyses waiting longer are scheduled before small ones, so large ones don't starve
+SCHEDULER_AGING_MINUTES = load_int_from_env("SCHEDULER_AGING_MINUTES", 60)
 
 DELETE_RESULTS_AFTER_N_DAYS = load_int_from_env("DELETE_RESULTS_AFTER_N_DAYS")
 
@@ -291,3 +329,38 @@ MAXIMUM_UPLOAD_TIME_IN_MINUTES = load_int_from_env("MAXIMUM_UPLOAD_TIME_IN_MINUT
 MAXIMUM_UPLOAD_SIZE_IN_MB = load_int_from_env("MAXIMUM_UPLOAD_SIZE_IN_MB")
 MAXIMUM_UPLOADS_IN_QUEUE = load_int_from_env("MAXIMUM_UPLOADS_IN_QUEUE")
 MAXIMUM_FRAMES_PER_SIMULATION = load_int_from_env("MAXIMUM_FRAMES_PER_SIMULATION")
+# new uploads are deferred below this much free space on the uploads volume,
+# space promised to uploads in progress counts as used
+UPLOADS_MIN_FREE_SPACE_IN_MB = load_int_from_env("UPLOADS_MIN_FREE_SPACE_IN_MB", 10240)
+# new uploads are deferred while more frames wait for analysis, unset disables
+MAXIMUM_QUEUED_FRAMES = load_int_from_env("MAXIMUM_QUEUED_FRAMES")
+# sent to deferred uploads as Retry-After
+UPLOAD_RETRY_AFTER_SECONDS = load_int_from_env("UPLOAD_RETRY_AFTER_SECONDS", 60)
+# sent to the browser, chunks must fit into client_max_body_size of nginx
+UPLOAD_CHUNK_SIZE_IN_MB = load_int_from_env("UPLOAD_CHUNK_SIZE_IN_MB", 8)
+UPLOAD_SIMULTANEOUS_CHUNKS = load_int_from_env("UPLOAD_SIMULTANEOUS_CHUNKS", 4)
+# nginx stores bodies of upload chunks here, see nginx/nginx.conf
+UPLOAD_BODIES_DIR = MEDIA_ROOT / "upload_bodies"
+# the same directory as seen by nginx, it sends paths of bodies under it
+UPLOAD_BODIES_PROXY_DIR = Path("/user_uploads/upload_bodies")
+# sent by nginx with every upload body, without it the body path is not trusted,
+# only the django service receives uploads
+if os.environ.get("UPLOAD_PROXY_SECRET_FILE") is not None:
+    UPLOAD_PROXY_SECRET = load_secret(os.environ.get("UPLOAD_PROXY_SECRET_FILE"))
+else:
+    UPLOAD_PROXY_SECRET = os.environ.get("UPLOAD_PROXY_SECRET")
+
+GROUP_ANALYSIS_CHUNK_ROWS = load_int_from_env("GROUP_ANALYSIS_CHUNK_ROWS", 100000)
+GROUP_ANALYSIS_PERMUTATIONS = load_int_from_env("GROUP_ANALYSIS_PERMUTATIONS", 1000)
+GROUP_ANALYSIS_BOOTSTRAP_RESAMPLES = load_int_from_env(
+    "GROUP_ANALYSIS_BOOTSTRAP_RESAMPLES", 1000
+)
+GROUP_ANALYSIS_SEED = load_int_from_env("GROUP_ANALYSIS_SEED", 0)
+
+# "local" aligns in-process against receptors kept in memory, "blast" runs blastp
+SEQUENCE_ALIGNER = os.environ.get("SEQUENCE_ALIGNER", "local")
+
+# point to a local server to run without network access to gpcrdb.org
+GPCRDB_URL = os.environ.get("GPCRDB_URL", "https://gpcrdb.org")
+GPCRDB_TIMEOUT = load_int_from_env("GPCRDB_TIMEOUT", 60)
+GPCRDB_MAX_CONCURRENT_REQUESTS = load_int_from_env("GPCRDB_MAX_CONCURRENT_REQUESTS", 4)
@@ -20,6 +20,9 @@ let selectedInput = null;
 const analysisGroup = new Array();
 const analysisGroupExpData = new Map();
 
+// kept between refreshes, the simulations list is rendered without estimates
+let simsEstimates = {};
+
 async function updateSimsData() {
 
 	for (const simContainer of simsContainer.children) {
@@ -44,6 +47,7 @@ async function updateSimsData() {
 	if (simsContainer.innerHTML != newHTML) {
 		simsContainer.innerHTML = newHTML;
 		prepareSimContainers();
+		applySimsEstimates();
 		return
 	}
 	await new Promise(r => setTimeout(r, 50));
@@ -52,6 +56,7 @@ async function updateSimsData() {
 	if (simsContainer.innerHTML != newHTML) {
 		simsContainer.innerHTML = newHTML;
 		prepareSimContainers();
+		applySimsEstimates();
 	}
 }
 
@@ -95,12 +100,13 @@ function getSimId(any_inner_element) {
 }
 
 
+const MAXIMUM_EXPERIMENTAL_VALS_COUNT = 4
 let experimentalValsCount = 0
 addExperimentalValsBtn.addEventListener("click", () => {
 	const emptyInsideContainer = analysisGroupContainer.querySelector(".empty-analysis-info");
 	console.log(emptyInsideContainer);
 	if (emptyInsideContainer == null) {
-		if (experimentalValsCount < 1) {
+		if (experimentalValsCount < MAXIMUM_EXPERIMENTAL_VALS_COUNT) {
 			experimentalValsCount += 1;
 		}
 	}
@@ -162,16 +168,18 @@ function updateAnalysisGroupDisplay() {
 	analysisGroup.forEach((element, index) => {
 		const removeBtn = cloneAndInsertNodeTemplate(removeBtnTemplate, analysisGroupContainer)
 		removeBtn.addEventListener('click', (event) => {
-			for (let i = index + 1; i < analysisGroup.length; i++) {
-				const currentVal = analysisGroupExpData.get(`0,${i}`);
-				if (currentVal != null) {
-					console.log("setting", currentVal, "into", `0,${i - 1}`)
-					analysisGroupExpData.set(`0,${i - 1}`, currentVal);
+			for (let col = 0; col < experimentalValsCount; col++) {
+				for (let i = index + 1; i < analysisGroup.length; i++) {
+					const currentVal = analysisGroupExpData.get(`${col},${i}`);
+					if (currentVal != null) {
+						console.log("setting", currentVal, "into", `${col},${i - 1}`)
+						analysisGroupExpData.set(`${col},${i - 1}`, currentVal);
 
+					}
 				}
+				// delete last element after moving one to the left
+				analysisGroupExpData.delete(`${col},${analysisGroup.length - 1}`);
 			}
-			// delete last element after moving one to the left
-			analysisGroupExpData.delete(`0,${analysisGroup.length - 1}`);
 			analysisGroup.splice(index, 1);
 			if (analysisGroup.length == 0) {
 				clearQueueAnalysis();
@@ -352,8 +360,34 @@ var r = new Resumable({
 		alert('Choose two files: topology and trajectory');
 	},
 	testChunks: false,
+	// chunks deferred by the server (503) are retried, until the server has room
+	chunkRetryInterval: 1000 * Number.parseFloat(document.getElementById("UPLOAD_RETRY_AFTER_SECONDS").value),
+	maxChunkRetries: 60,
+	// chunk offsets are computed by the server from the chunk size
+	forceChunkSize: true,
+	// nginx writes chunk bodies to files, multipart bodies would never reach django
+	method: 'octet',
 });
 
+// chunk size, parallel chunks and upload method are set by the server
+const uploadConfigLoaded = fetch("api/upload-config", {})
+	.then((response) => {
+		if (!response.ok) {
+			throw new Error(`status ${response.status}`);
+		}
+		return response.json();
+	})
+	.then((config) => {
+		r.opts.chunkSize = config.chunkSize;
+		r.opts.simultaneousUploads = config.simultaneousUploads;
+		r.opts.method = config.method;
+		return true;
+	})
+	.catch((error) => {
+		console.log('Failed to load upload options: ', error);
+		return false;
+	});
+
 
 function getFileMainDirectory(file) {
 	return file.relativePath.split('/')[0]
@@ -420,7 +454,7 @@ inputTypeSelect.addEventListener('change', (event) => {
 });
 
 const MAXIMUM_FILE_SIZE_IN_MB = Number.parseFloat(document.getElementById("MAXIMUM_FILE_SIZE_IN_MB").value);
-confirmButton.addEventListener("click", (event) => {
+confirmButton.addEventListener("click", async (event) => {
 	const fileCount = r.files.length;
 	if (fileCount <= 0) {
 		return;
@@ -439,6 +473,12 @@ confirmButton.addEventListener("click", (event) => {
 		return;
 	}
 
+	// chunks split with other options than the server expects would be rejected
+	if (!await uploadConfigLoaded) {
+		alert('Uploads are unavailable right now, please reload the page');
+		return;
+	}
+
 	uploadStatusIndicator.classList.remove("hidden");
 	confirmButton.classList.remove("rounded-r-lg");
 
@@ -468,6 +508,8 @@ confirmButton.addEventListener("click", (event) => {
 		r.files.forEach((file) => { file.relativePath = `${dirName}/${file.fileName}` })
 	}
 
+	// files added before the options arrived are split again
+	r.files.forEach((file) => file.bootstrap());
 	console.log('Starting upload!');
 	r.upload();
 });
@@ -476,6 +518,10 @@ r.on('progress', function(event) {
 	uploadStatusIndicator.innerText = (r.progress() * 100).toPrecision(4) + "%";
 });
 
+r.on('fileRetry', function(file) {
+	uploadStatusIndicator.innerText = "Server busy, waiting...";
+});
+
 async function deleteAnalysis(analysisContainer) {
 	const resultsId = analysisContainer.querySelector("a").href.split("/").at(-1)
 	const response = fetch("api/group/delete", {
@@ -520,4 +566,61 @@ async function prepareAnalysisContainers() {
 prepareSimContainers();
 prepareAnalysisContainers();
 resetResumableFileUploaderState();
-setInterval(updateSimsData, 10000)
+
+// status changes are pushed by the server, polling is only a fallback
+function applySimEvent(simEvent) {
+	const simContainer = simsContainer.querySelector(`.sim-data[data-sim-id="${simEvent.simId}"]`);
+	if (simContainer == null || simContainer.dataset.state != simEvent.state || simEvent.wasDeleted) {
+		// available actions depend on the state, so the whole list is fetched again
+		updateSimsData();
+		return;
+	}
+	simContainer.querySelector(".sim-status").innerText = simEvent.status;
+}
+
+function applySimsEstimates() {
+	for (const simContainer of simsContainer.querySelectorAll(".sim-data")) {
+		const estimate = simsEstimates[simContainer.dataset.simId];
+		simContainer.querySelector(".sim-eta").innerText = estimate ? `(${estimate.description})` : "";
+	}
+}
+
+async function updateSimsEstimates() {
+	const response = await fetch("api/sims-estimates", {});
+	simsEstimates = await response.json();
+	applySimsEstimates();
+}
+
+// events only carry status changes, estimates move on their own
+updateSimsEstimates();
+setInterval(updateSimsEstimates, 60000);
+
+let pollingIntervalId = null;
+
+function startPolling() {
+	if (pollingIntervalId == null) {
+		pollingIntervalId = setInterval(updateSimsData, 10000);
+	}
+}
+
+function listenForSimEvents() {
+	const simEvents = new EventSource("api/sims-events");
+	simEvents.onmessage = (event) => applySimEvent(JSON.parse(event.data));
+	simEvents.onopen = () => {
+		clearInterval(pollingIntervalId);
+		pollingIntervalId = null;
+		// catch up on changes missed while disconnected
+		updateSimsData();
+	};
+	simEvents.onerror = () => {
+		if (simEvents.readyState == EventSource.CLOSED) {
+			startPolling();
+		}
+	};
+}
+
+if (window.EventSource) {
+	listenForSimEvents();
+} else {
+	startPolling();
+}
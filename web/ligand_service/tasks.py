@@ -2,35 +2,88 @@ from datetime import datetime, timedelta
 from pathlib import Path
 import json
 import logging
+import contextlib
 import functools
 import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+from xml.parsers.expat import ExpatError
 import pandas as pd
 import xmltodict
 
 from huey import crontab
-from huey.contrib.djhuey import periodic_task, task
+from huey.contrib.djhuey import (
+    HUEY,
+    close_db,
+    periodic_task,
+    post_execute,
+    signal,
+    task,
+)
+from huey.exceptions import CancelExecution, TaskException
+from huey.signals import (
+    SIGNAL_CANCELED,
+    SIGNAL_COMPLETE,
+    SIGNAL_ERROR,
+    SIGNAL_EXECUTING,
+    SIGNAL_INTERRUPTED,
+    SIGNAL_REVOKED,
+)
 
 from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
 
-from ligand_service.models import Simulation
+from ligand_service.models import AnalysisRecord, Simulation
+from ligand_service.utils import (
+    get_user_results_dir,
+    get_user_uploads_dir,
+    get_user_work_dir,
+)
 
 from .contacts import (
+    AnalysisCancelled,
+    get_atom_count,
     get_trajectory_frame_count,
-    create_translation_dict_by_blast,
+    create_numbering_table,
+    get_sequence_chains,
+    annotate_numbering,
+    NUMBERING_COLUMNS,
+    NUMBERING_KEY_COLUMNS,
     get_interactions_from_trajectory,
 )
 
+from . import admission  # noqa: F401, keeps upload admission counters in sync
+from .correlations import compute_group_correlations
+from .scheduling import pick_analyses
+from .preparation import preparation_huey
 from .graphs import (
     plot_contact_fraction_heatmap,
     plot_correlation_covariance_heatmaps,
     create_getcontacts_table,
+    count_interactions,
     create_interaction_area_graph,
     create_time_resolved_map,
+    merge_contact_summaries,
+    plot_interaction_counts,
+    summarise_contacts,
+    CONTACT_SUMMARY_COLUMNS,
 )
 
 LIGAND_DETECTION_THRESHOLD = 0.7
 INCHIKEY_TO_NAME_JSON_PATH = Path("./chebi/inchikey_to_name.json")
 INCHIKEY_TO_CHEBIID_JSON_PATH = Path("./chebi/inchikey_to_chebiID.json")
+CONTACT_SUMMARY_FILENAME = "contact_summary.csv"
+GROUP_SUMMARY_FILENAME = "group_summary.csv"
+GROUP_MEMBERS_DIRNAME = "members"
+GROUP_CSV_BLOCK_SIZE = 1024 * 1024
+PREPARATION_FILENAME = "preparation.json"
+NUMBERING_FILENAME = "numbering.csv"
+PARTIAL_RESULTS_FILENAME = "partial_results.json"
+# seconds between updates of the partial results of a running analysis
+PARTIAL_RESULTS_INTERVAL = 30
 
 INTERACTION_TYPE_RENAME = {
     "hydrophobic_interactions": "Hydrophobic",
@@ -64,10 +117,8 @@ def save_file(file_handle, path_to_save_location: Path):
             destination.write(chunk)
 
 
-def extract_data_from_plip_results(
-    results_dir: Path,
-) -> tuple[pd.DataFrame, pd.DataFrame] | None:
-    frames_data = {
+def new_frames_data() -> dict[str, list]:
+    return {
         "Frame": [],
         "Interaction type": [],
         "Residue chain": [],
@@ -77,7 +128,10 @@ def extract_data_from_plip_results(
         "Ligand residue name": [],
         "Ligand residue number": [],
     }
-    ligand_info = {
+
+
+def new_ligand_info() -> dict[str, list]:
+    return {
         "frames_seen": [],
         "name": [],
         "ligtype": [],
@@ -85,74 +139,82 @@ def extract_data_from_plip_results(
         "inchikey": [],
         # "img": [],
     }
+
+
+def add_plip_report(frame_dir: Path, frames_data: dict, ligand_info: dict):
+    """Appends interactions and ligands of one analysed frame."""
+    with open(frame_dir / "report.xml") as f:
+        file_contents = f.read()
+        out = xmltodict.parse(file_contents)
+        binding_sites = out["report"]["bindingsite"]
+        # handling of instance, where there is only one binding site
+        if not isinstance(binding_sites, list):
+            binding_sites = [binding_sites]
+        for binding_site in binding_sites:
+            if binding_site["@has_interactions"] == "False":
+                logger.info(f"Skipping binding_site: {binding_site}")
+                continue
+            ident = binding_site["identifiers"]
+            interactions = binding_site["interactions"]
+            inchikey = ident["inchikey"]
+            if inchikey in ligand_info["inchikey"]:
+                idx = ligand_info["inchikey"].index(inchikey)
+                ligand_info["frames_seen"][idx] += 1
+            else:
+                logger.info(f"Adding new ligand: {inchikey}")
+                ligand_info["frames_seen"].append(1)
+                ligand_info["name"].append(ident["longname"])
+                ligand_info["ligtype"].append(ident["ligtype"])
+                ligand_info["smiles"].append(ident["smiles"])
+                ligand_info["inchikey"].append(inchikey)
+
+            # mol = Chem.MolFromSmiles(ident["smiles"])
+            # logger.info(f"Molecule created from SMILES")
+            # if mol is not None:
+            #     img = Draw.MolToImage(mol, size=(300, 300))
+            #     logger.info(f"Image created from mol")
+            #     buffer = BytesIO()
+            #     img.save(buffer, format="PNG")
+            #     img_str = base64.b64encode(buffer.getvalue()).decode()
+            #     inlined_image = (
+            #         f'<img src="data:image/png;base64,{img_str}">'
+            #     )
+            #     ligand_info["img"].append(inlined_image)
+            # else:
+            #     ligand_info["img"].append("")
+
+            for interaction_type in interactions:
+                for contacts_lists in interactions[interaction_type] or []:
+                    contacts = interactions[interaction_type][contacts_lists]
+                    # handling of instance where there is only one interaction of given type,
+                    # xmltodict doesn't make a list in this case, it just provides the value
+                    if not isinstance(contacts, list):
+                        contacts = [contacts]
+                    for value in contacts:
+                        frames_data["Frame"].append(int(frame_dir.stem[5:]))
+                        frames_data["Interaction type"].append(
+                            INTERACTION_TYPE_RENAME[interaction_type]
+                        )
+                        frames_data["Residue chain"].append(value["reschain"])
+                        frames_data["Residue number"].append(value["resnr"])
+                        frames_data["Residue name"].append(value["restype"])
+                        frames_data["Ligand residue chain"].append(
+                            value["reschain_lig"]
+                        )
+                        frames_data["Ligand residue number"].append(value["resnr_lig"])
+                        frames_data["Ligand residue name"].append(value["restype_lig"])
+
+
+def extract_data_from_plip_results(
+    results_dir: Path,
+) -> tuple[pd.DataFrame, pd.DataFrame] | None:
+    frames_data = new_frames_data()
+    ligand_info = new_ligand_info()
     logger.info("Extracting data from plip results...")
     for dir in sorted(results_dir.iterdir(), key=lambda x: (len(str(x)), x)):
         if not dir.is_dir():
             continue
-        with open(dir / "report.xml") as f:
-            file_contents = f.read()
-            out = xmltodict.parse(file_contents)
-            binding_sites = out["report"]["bindingsite"]
-            # handling of instance, where there is only one binding site
-            if not isinstance(binding_sites, list):
-                binding_sites = [binding_sites]
-            for binding_site in binding_sites:
-                if binding_site["@has_interactions"] == "False":
-                    logger.info(f"Skipping binding_site: {binding_site}")
-                    continue
-                ident = binding_site["identifiers"]
-                interactions = binding_site["interactions"]
-                inchikey = ident["inchikey"]
-                if inchikey in ligand_info["inchikey"]:
-                    idx = ligand_info["inchikey"].index(inchikey)
-                    ligand_info["frames_seen"][idx] += 1
-                else:
-                    logger.info(f"Adding new ligand: {inchikey}")
-                    ligand_info["frames_seen"].append(1)
-                    ligand_info["name"].append(ident["longname"])
-                    ligand_info["ligtype"].append(ident["ligtype"])
-                    ligand_info["smiles"].append(ident["smiles"])
-                    ligand_info["inchikey"].append(inchikey)
-
-                # mol = Chem.MolFromSmiles(ident["smiles"])
-                # logger.info(f"Molecule created from SMILES")
-                # if mol is not None:
-                #     img = Draw.MolToImage(mol, size=(300, 300))
-                #     logger.info(f"Image created from mol")
-                #     buffer = BytesIO()
-                #     img.save(buffer, format="PNG")
-                #     img_str = base64.b64encode(buffer.getvalue()).decode()
-                #     inlined_image = (
-                #         f'<img src="data:image/png;base64,{img_str}">'
-                #     )
-                #     ligand_info["img"].append(inlined_image)
-                # else:
-                #     ligand_info["img"].append("")
-
-                for interaction_type in interactions:
-                    for contacts_lists in interactions[interaction_type] or []:
-                        contacts = interactions[interaction_type][contacts_lists]
-                        # handling of instance where there is only one interaction of given type,
-                        # xmltodict doesn't make a list in this case, it just provides the value
-                        if not isinstance(contacts, list):
-                            contacts = [contacts]
-                        for value in contacts:
-                            frames_data["Frame"].append(int(dir.stem[5:]))
-                            frames_data["Interaction type"].append(
-                                INTERACTION_TYPE_RENAME[interaction_type]
-                            )
-                            frames_data["Residue chain"].append(value["reschain"])
-                            frames_data["Residue number"].append(value["resnr"])
-                            frames_data["Residue name"].append(value["restype"])
-                            frames_data["Ligand residue chain"].append(
-                                value["reschain_lig"]
-                            )
-                            frames_data["Ligand residue number"].append(
-                                value["resnr_lig"]
-                            )
-                            frames_data["Ligand residue name"].append(
-                                value["restype_lig"]
-                            )
+        add_plip_report(dir, frames_data, ligand_info)
     frame_df = pd.DataFrame(frames_data)
     ligand_df = pd.DataFrame(ligand_info)
     ligand_df.drop_duplicates(inplace=True)
@@ -176,8 +238,103 @@ else:
         inchikey_to_chebiID = json.load(f)
 
 
+class PartialResults:
+    """Aggregates PLIP reports of a running analysis as frames are finished.
+
+    Every report is read once, interaction counts and the contact summary grow with
+    each update and are written to the results directory, flagged as partial.
+    """
+
+    def __init__(self, plip_dir: Path, results_dir: Path, frame_count: int):
+        self.plip_dir = plip_dir
+        self.results_dir = results_dir
+        self.frame_count = frame_count
+        self.parsed: set[str] = set()
+        self.interaction_count: pd.DataFrame | None = None
+        self.summary: pd.DataFrame | None = None
+        self.last_update = 0.0
+
+    def read_new_frames(self) -> tuple[pd.DataFrame, set[str]]:
+        """Reads reports not aggregated yet, returns their contacts and frame names."""
+        frames_data = new_frames_data()
+        parsed = set()
+        for frame_dir in self.plip_dir.iterdir():
+            if frame_dir.name in self.parsed:
+                continue
+            if not (frame_dir / "report.xml").is_file():
+                continue
+            try:
+                add_plip_report(frame_dir, frames_data, new_ligand_info())
+            except ExpatError:
+                # report is still being written, it is read on the next update
+                continue
+            parsed.add(frame_dir.name)
+        return pd.DataFrame(frames_data), parsed
+
+    def update(self, frames_done: int):
+        if time.monotonic() - self.last_update < PARTIAL_RESULTS_INTERVAL:
+            return
+        self.last_update = time.monotonic()
+        if not self.plip_dir.is_dir():
+            # the simulation was deleted, its results directory is not recreated
+            return
+        try:
+            contacts_df, parsed = self.read_new_frames()
+            if len(contacts_df) > 0:
+                interaction_count = pd.concat(
+                    [self.interaction_count, count_interactions(contacts_df)],
+                    ignore_index=True,
+                ).sort_values("Frame", kind="stable")
+                summary = _merge_summary(self.summary, summarise_contacts(contacts_df))
+                self.interaction_count, self.summary = interaction_count, summary
+            # marked only once aggregated, frames of a failed update are read again
+            self.parsed |= parsed
+            if self.summary is not None:
+                self.save(frames_done)
+        except Exception as e:
+            # partial results are a preview, the analysis goes on without them
+            print(f"Failed to update partial results: {e}", flush=True)
+
+    def save(self, frames_done: int):
+        fractions = self.summary.assign(
+            **{
+                "Contact fraction": 100.0
+                * self.summary["Frames with contact"]
+                / self.summary["Total frames"]
+            }
+        )
+        partial_results = {
+            "partial": True,
+            "frames_done": frames_done,
+            "frames_parsed": len(self.parsed),
+            "frame_count": self.frame_count,
+            "interaction_graph": plot_interaction_counts(self.interaction_count),
+            "contact_fractions": fractions.to_dict(orient="records"),
+        }
+        self.results_dir.mkdir(exist_ok=True, parents=True)
+        path = self.results_dir / PARTIAL_RESULTS_FILENAME
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(partial_results, f)
+        # readers never see a half written file
+        tmp_path.replace(path)
+
+
+def load_partial_results(results_dir: Path) -> dict | None:
+    try:
+        with open(results_dir / PARTIAL_RESULTS_FILENAME) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
 def analyse_simulation(
-    top_file: Path, traj_file: Path, plip_dir: Path, results_dir: Path
+    top_file: Path,
+    traj_file: Path,
+    plip_dir: Path,
+    results_dir: Path,
+    frame_count: int,
+    numbering: tuple[pd.DataFrame, dict] | None,
 ):
     run_data = {}
     out = extract_data_from_plip_results(plip_dir)
@@ -186,34 +343,29 @@ def analyse_simulation(
     shutil.rmtree(plip_dir)
     df = out[0]
     ligand_df = out[1]
-    dic, scores = create_translation_dict_by_blast(top_file, traj_file)
+    numbering_df, scores = (
+        numbering
+        if numbering is not None
+        else (pd.DataFrame(columns=NUMBERING_KEY_COLUMNS + NUMBERING_COLUMNS), {})
+    )
     run_data["name"] = top_file.parent.name
     run_data["alignment_scores"] = scores
+    run_data["pocket_size"] = len(df[NUMBERING_KEY_COLUMNS].drop_duplicates())
 
-    def get_numbering_blast(row):
-        assert dic is not None
-        key = (
-            row["Residue chain"],
-            row["Residue name"],
-            str(row["Residue name"]),
-        )
-        if key in dic:
-            return dic[key]
-
-    df["Aligned numbering"] = df.apply(get_numbering_blast, axis=1)
+    df = annotate_numbering(df, numbering_df)
     run_data["interaction_graph"] = create_interaction_area_graph(df)
     results_dir.mkdir(exist_ok=True, parents=True)
     df.to_csv(
         path_or_buf=(results_dir / "interactions.csv"),
         index=False,
     )
+    summarise_contacts(df).to_csv(results_dir / CONTACT_SUMMARY_FILENAME, index=False)
 
     ligands_arr = []
     for ligand in ligand_df.to_dict(orient="records"):
-        simulation_frame_count = get_trajectory_frame_count(top_file, traj_file)
-        if ligand["frames_seen"] / simulation_frame_count < LIGAND_DETECTION_THRESHOLD:
+        if ligand["frames_seen"] / frame_count < LIGAND_DETECTION_THRESHOLD:
             print(
-                f"Skipping ligand below threshold, seen in {ligand['frames_seen']} out of {simulation_frame_count}",
+                f"Skipping ligand below threshold, seen in {ligand['frames_seen']} out of {frame_count}",
                 flush=True,
             )
             continue
@@ -238,50 +390,169 @@ def analyse_simulation(
 
     with open(results_dir / "run_data.json", "w") as f:
         json.dump(run_data, f)
+    (results_dir / PARTIAL_RESULTS_FILENAME).unlink(missing_ok=True)
 
     print("Analysis finished! Results available at: ", results_dir, flush=True)
 
     return run_data
 
 
-def analyse_group(results_dirs: list[Path], group_result_dir: Path):
-    sims_data = []
-    for dir in results_dirs:
-        with open(dir / "run_data.json") as f:
-            raw = f.read()
-            data = json.loads(raw)
-            sims_data.append(data)
+def _merge_summary(summary: pd.DataFrame | None, chunk_summary: pd.DataFrame):
+    if summary is None:
+        return chunk_summary
+    return merge_contact_summaries(summary, chunk_summary)
 
-    interactions = []
-    for dir in results_dirs:
-        with open(dir / "interactions.csv") as f:
-            interactions.append(
-                (
-                    dir.name,
-                    pd.read_csv(f),
+
+def summarise_interactions_file(interactions_path: Path) -> pd.DataFrame:
+    """Summarises contacts of a simulation, reading its interactions in chunks.
+
+    Interactions are written frame by frame, rows of the last frame of a chunk are
+    carried over to the next one, so every frame is summarised within one chunk.
+    """
+    summary = None
+    carried_over = None
+    with pd.read_csv(
+        interactions_path, chunksize=settings.GROUP_ANALYSIS_CHUNK_ROWS
+    ) as reader:
+        for chunk in reader:
+            if carried_over is not None:
+                chunk = pd.concat([carried_over, chunk], ignore_index=True)
+            last_frame = chunk["Frame"].iloc[-1]
+            carried_over = chunk[chunk["Frame"] == last_frame]
+            chunk = chunk[chunk["Frame"] != last_frame]
+            if len(chunk) > 0:
+                summary = _merge_summary(summary, summarise_contacts(chunk))
+    if carried_over is not None:
+        summary = _merge_summary(summary, summarise_contacts(carried_over))
+    if summary is None:
+        return pd.DataFrame(columns=CONTACT_SUMMARY_COLUMNS)
+    return summary
+
+
+def load_contact_summary(results_dir: Path) -> pd.DataFrame:
+    summary_path = results_dir / CONTACT_SUMMARY_FILENAME
+    if summary_path.is_file():
+        return pd.read_csv(summary_path)
+    # results created before contact summaries were stored next to them
+    summary = summarise_interactions_file(results_dir / "interactions.csv")
+    summary.to_csv(summary_path, index=False)
+    return summary
+
+
+def append_group_member_interactions(
+    results_dir: Path, exp_row: pd.Series, group_csv: Path
+):
+    with pd.read_csv(
+        results_dir / "interactions.csv", chunksize=settings.GROUP_ANALYSIS_CHUNK_ROWS
+    ) as reader:
+        for df in reader:
+            for value_name in exp_row.index[2:]:
+                df[value_name] = exp_row[value_name]
+            df["Simulation name"] = exp_row["Simulation name"]
+            df["Simulation ID"] = exp_row["Simulation ID"]
+            if group_csv.is_file():
+                # results from before a column was added are padded with empty values
+                df = df.reindex(columns=pd.read_csv(group_csv, nrows=0).columns)
+            df.to_csv(group_csv, mode="a", header=not group_csv.is_file(), index=False)
+
+
+def group_member_csv(group_result_dir: Path, sim_id: str) -> Path:
+    return group_result_dir / GROUP_MEMBERS_DIRNAME / f"{sim_id}.csv"
+
+
+def write_group_member(group_result_dir: Path, exp_row: pd.Series):
+    """Writes interactions of one member, with its experimental values, to its own
+    file in the group, so members are added and removed without touching the rest.
+    """
+    member_csv = group_member_csv(group_result_dir, exp_row["Simulation ID"])
+    member_csv.parent.mkdir(exist_ok=True)
+    temp_csv = member_csv.with_name(f"{member_csv.name}.tmp")
+    temp_csv.unlink(missing_ok=True)
+    append_group_member_interactions(
+        get_user_results_dir(exp_row["Simulation ID"]), exp_row, temp_csv
+    )
+    if temp_csv.is_file():
+        temp_csv.replace(member_csv)
+
+
+def split_group_csv(group_result_dir: Path):
+    """Splits group.csv of a group created before its members had their own files."""
+    group_csv = group_result_dir / "group.csv"
+    if not group_csv.is_file():
+        return
+    members_dir = group_result_dir / GROUP_MEMBERS_DIRNAME
+    # files left by an interrupted split are written again
+    shutil.rmtree(members_dir, ignore_errors=True)
+    members_dir.mkdir()
+    with pd.read_csv(group_csv, chunksize=settings.GROUP_ANALYSIS_CHUNK_ROWS) as reader:
+        for group_df in reader:
+            for sim_id, member_df in group_df.groupby("Simulation ID", sort=False):
+                member_csv = group_member_csv(group_result_dir, sim_id)
+                member_df.to_csv(
+                    member_csv, mode="a", header=not member_csv.is_file(), index=False
+                )
+    group_csv.unlink()
+
+
+def iter_group_csv(group_result_dir: Path):
+    """Yields group.csv in blocks, rows of the members in the order of exp_data.csv."""
+    exp_data = pd.read_csv(group_result_dir / "exp_data.csv")
+    first_csv = None
+    for sim_id in exp_data["Simulation ID"]:
+        member_csv = group_member_csv(group_result_dir, sim_id)
+        if not member_csv.is_file():
+            continue
+        with open(member_csv, "rb") as f:
+            header = f.readline()
+            if first_csv is None:
+                first_csv, first_header = member_csv, header
+                yield header
+            if header == first_header:
+                while block := f.read(GROUP_CSV_BLOCK_SIZE):
+                    yield block
+                continue
+        # results from before a column was added are padded with empty values
+        columns = pd.read_csv(first_csv, nrows=0).columns
+        with pd.read_csv(
+            member_csv, chunksize=settings.GROUP_ANALYSIS_CHUNK_ROWS
+        ) as reader:
+            for df in reader:
+                yield (
+                    df.reindex(columns=columns)
+                    .to_csv(header=False, index=False)
+                    .encode()
                 )
-            )
 
-    with open(group_result_dir / "exp_data.csv") as f:
-        exp_data = pd.read_csv(f)
 
-    prepared_dfs = []
-    for id, df in interactions:
-        sim_name = exp_data.loc[
-            exp_data["Simulation ID"] == id, "Simulation name"
-        ].iloc[0]
-        if len(exp_data.columns.tolist()) > 2:
-            value_name = exp_data.columns.tolist()[2]
-            value = exp_data.loc[exp_data["Simulation ID"] == id, value_name].iloc[0]
-            df[value_name] = value
-        df["Simulation name"] = sim_name
-        df["Simulation ID"] = id
-        prepared_dfs.append(df)
+def member_contact_summary(exp_row: pd.Series) -> pd.DataFrame:
+    summary = load_contact_summary(get_user_results_dir(exp_row["Simulation ID"]))
+    summary["Simulation name"] = exp_row["Simulation name"]
+    summary["Simulation ID"] = exp_row["Simulation ID"]
+    return summary
 
-    group_df = pd.concat(prepared_dfs)
-    group_df.to_csv(group_result_dir / "group.csv", index=False)
 
-    interaction_freq_map = plot_contact_fraction_heatmap(group_df)
+def load_group_summary(group_result_dir: Path, exp_data: pd.DataFrame) -> pd.DataFrame:
+    """Contact summaries of all members, rows of the group's count matrix."""
+    summary_path = group_result_dir / GROUP_SUMMARY_FILENAME
+    if summary_path.is_file():
+        return pd.read_csv(summary_path)
+    # groups created before their summary was stored
+    summary_df = pd.concat(
+        [member_contact_summary(exp_row) for _, exp_row in exp_data.iterrows()],
+        ignore_index=True,
+    )
+    _write_csv(summary_df, summary_path)
+    return summary_df
+
+
+def render_group_analysis(
+    group_result_dir: Path, exp_data: pd.DataFrame, summary_df: pd.DataFrame
+):
+    """Recreates group graphs from the contact summaries of its members."""
+    # rows of a member whose addition was interrupted, its retry adds them again
+    summary_df = summary_df[summary_df["Simulation ID"].isin(exp_data["Simulation ID"])]
+
+    interaction_freq_map = plot_contact_fraction_heatmap(summary_df)
 
     group_data = {
         "exp_data": exp_data.to_dict(orient="split", index=False),
@@ -289,8 +560,18 @@ def analyse_group(results_dirs: list[Path], group_result_dir: Path):
     }
 
     if len(exp_data.columns) > 2:
+        correlations = compute_group_correlations(
+            summary_df,
+            exp_data,
+            permutations=settings.GROUP_ANALYSIS_PERMUTATIONS,
+            resamples=settings.GROUP_ANALYSIS_BOOTSTRAP_RESAMPLES,
+            seed=settings.GROUP_ANALYSIS_SEED,
+        )
+        correlations.to_frame().to_csv(
+            group_result_dir / "correlations.csv", index=False
+        )
         interaction_correlation_map, interaction_covariance_map = (
-            plot_correlation_covariance_heatmaps(group_df)
+            plot_correlation_covariance_heatmaps(correlations)
         )
         group_data["interaction_correlation_map"] = interaction_correlation_map
         group_data["interaction_covariance_map"] = interaction_covariance_map
@@ -298,24 +579,535 @@ def analyse_group(results_dirs: list[Path], group_result_dir: Path):
     with open(group_result_dir / "group_data.json", "w") as f:
         json.dump(group_data, f)
 
+
+def analyse_group(results_dirs: list[Path], group_result_dir: Path):
+    with open(group_result_dir / "exp_data.csv") as f:
+        exp_data = pd.read_csv(f)
+
+    summaries = []
+    for dir in results_dirs:
+        exp_row = exp_data.loc[exp_data["Simulation ID"] == dir.name].iloc[0]
+        write_group_member(group_result_dir, exp_row)
+        summaries.append(member_contact_summary(exp_row))
+    summary_df = pd.concat(summaries, ignore_index=True)
+    _write_csv(summary_df, group_result_dir / GROUP_SUMMARY_FILENAME)
+
+    render_group_analysis(group_result_dir, exp_data, summary_df)
+
     return None
 
 
 @task()
+def start_group_analysis(results_dirs: list[Path], group_result_dir: Path):
+    analyse_group(results_dirs, group_result_dir)
+
+
+# updates of one group run one at a time, later ones retry until the lock is free
+GROUP_UPDATE_RETRIES = 20
+GROUP_UPDATE_RETRY_DELAY = 30
+
+
+def _group_lock_name(group_result_dir: Path) -> str:
+    return f"group-analysis-{group_result_dir.name}"
+
+
+def _write_csv(df: pd.DataFrame, path: Path):
+    # replaced at once, a failed update leaves the previous file
+    temp_path = path.with_name(f"{path.name}.tmp")
+    df.to_csv(temp_path, index=False)
+    temp_path.replace(path)
+
+
+def new_group_members(group_result_dir: Path, members: pd.DataFrame) -> pd.DataFrame:
+    """Rows of exp_data.csv for the simulations not in the group yet.
+
+    Raises ValueError, when experimental values are missing or not numbers.
+    """
+    exp_data = pd.read_csv(group_result_dir / "exp_data.csv")
+    missing_columns = set(exp_data.columns) - set(members.columns)
+    if missing_columns:
+        raise ValueError(f"Missing experimental data: {missing_columns}")
+    members = members.loc[
+        ~members["Simulation ID"].isin(exp_data["Simulation ID"]),
+        exp_data.columns,
+    ]
+    for value_name in exp_data.columns[2:]:
+        members[value_name] = pd.to_numeric(members[value_name])
+    return members
+
+
+def add_group_members(group_result_dir: Path, members: pd.DataFrame):
+    """Adds simulations to an existing group analysis.
+
+    `members` holds the new rows of exp_data.csv, only interactions of the added
+    simulations are read and written, the rest of the group is left as it is.
+    """
+    members = new_group_members(group_result_dir, members)
+    added_ids = members["Simulation ID"].to_list()
+
+    split_group_csv(group_result_dir)
+    exp_data = pd.read_csv(group_result_dir / "exp_data.csv")
+    summary_df = load_group_summary(group_result_dir, exp_data)
+    for _, exp_row in members.iterrows():
+        write_group_member(group_result_dir, exp_row)
+    # rows left by an interrupted update are dropped, so a retry doesn't repeat them
+    summary_df = pd.concat(
+        [
+            summary_df[~summary_df["Simulation ID"].isin(added_ids)],
+            *(member_contact_summary(exp_row) for _, exp_row in members.iterrows()),
+        ],
+        ignore_index=True,
+    )
+    _write_csv(summary_df, group_result_dir / GROUP_SUMMARY_FILENAME)
+
+    exp_data = pd.concat([exp_data, members], ignore_index=True)
+    _write_csv(exp_data, group_result_dir / "exp_data.csv")
+
+    render_group_analysis(group_result_dir, exp_data, summary_df)
+
+
+def remove_group_members(group_result_dir: Path, sim_ids: list[str]):
+    """Removes simulations from an existing group analysis."""
+    split_group_csv(group_result_dir)
+    exp_data = pd.read_csv(group_result_dir / "exp_data.csv")
+    summary_df = load_group_summary(group_result_dir, exp_data)
+
+    exp_data = exp_data[~exp_data["Simulation ID"].isin(sim_ids)]
+    _write_csv(exp_data, group_result_dir / "exp_data.csv")
+    summary_df = summary_df[~summary_df["Simulation ID"].isin(sim_ids)]
+    _write_csv(summary_df, group_result_dir / GROUP_SUMMARY_FILENAME)
+    for sim_id in sim_ids:
+        group_member_csv(group_result_dir, sim_id).unlink(missing_ok=True)
+
+    render_group_analysis(group_result_dir, exp_data, summary_df)
+
+
+@task(retries=GROUP_UPDATE_RETRIES, retry_delay=GROUP_UPDATE_RETRY_DELAY)
+def start_adding_group_members(group_result_dir: Path, members: pd.DataFrame):
+    with HUEY.lock_task(_group_lock_name(group_result_dir)):
+        add_group_members(group_result_dir, members)
+
+
+@task(retries=GROUP_UPDATE_RETRIES, retry_delay=GROUP_UPDATE_RETRY_DELAY)
+def start_removing_group_members(group_result_dir: Path, sim_ids: list[str]):
+    with HUEY.lock_task(_group_lock_name(group_result_dir)):
+        remove_group_members(group_result_dir, sim_ids)
+
+
+class Preparation(NamedTuple):
+    frame_count: int
+    numbering: tuple[pd.DataFrame, dict] | None
+
+
+def save_preparation(work_dir: Path, preparation: Preparation):
+    scores = {}
+    if preparation.numbering is not None:
+        numbering_df, scores = preparation.numbering
+        numbering_df.to_csv(work_dir / NUMBERING_FILENAME, index=False)
+    with open(work_dir / PREPARATION_FILENAME, "w") as f:
+        json.dump(
+            {"frame_count": preparation.frame_count, "alignment_scores": scores}, f
+        )
+
+
+def load_preparation(work_dir: Path) -> Preparation | None:
+    if not (work_dir / PREPARATION_FILENAME).is_file():
+        return None
+    with open(work_dir / PREPARATION_FILENAME) as f:
+        metadata = json.load(f)
+    numbering = None
+    if (work_dir / NUMBERING_FILENAME).is_file():
+        numbering_df = pd.read_csv(
+            work_dir / NUMBERING_FILENAME, dtype=str, keep_default_na=False
+        )
+        numbering = numbering_df, metadata["alignment_scores"]
+    return Preparation(metadata["frame_count"], numbering)
+
+
+@preparation_huey.task()
+@close_db
+def prepare_simulation(sim_id: str):
+    """Does the cheap work needed by the analysis, then queues the analysis."""
+    sim = Simulation.objects.get(sim_id=sim_id)
+    if remove_files_if_deleted(sim):
+        return
+    # file detection walks the whole upload, Maestro layouts twice
+    files = sim.get_trajectory_files()
+    if files is None:
+        print(f"No trajectory files found for {sim}", flush=True)
+        sim.status = Simulation.Status.INVALID_FILES
+        sim.save(update_fields=["status"])
+        remove_files_if_deleted(sim)
+        return
+    work_dir = get_user_work_dir(sim.user_key) / str(sim.sim_id)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    if load_preparation(work_dir) is None:
+        print(f"Preparing {sim}", flush=True)
+        if sim.frame_count is None:
+            sim.frame_count = get_trajectory_frame_count(
+                files.topology, files.trajectory
+            )
+            sim.save(update_fields=["frame_count"])
+        if sim.atom_count is None:
+            sim.atom_count = get_atom_count(files.topology)
+            sim.save(update_fields=["atom_count"])
+        if (
+            settings.MAXIMUM_FRAMES_PER_SIMULATION is not None
+            and settings.MAXIMUM_FRAMES_PER_SIMULATION < sim.frame_count
+        ):
+            sim.status = Simulation.Status.TOO_MANY_FRAMES
+            sim.save(update_fields=["status"])
+            remove_files_if_deleted(sim)
+            return
+        seq_chains = get_sequence_chains(files.topology, files.trajectory)
+        save_preparation(
+            work_dir, Preparation(sim.frame_count, create_numbering_table(seq_chains))
+        )
+    sim.status = Simulation.Status.READY
+    sim.queued_at = timezone.now()
+    sim.save(update_fields=["status", "queued_at"])
+    if remove_files_if_deleted(sim):
+        return
+    dispatch_analyses()
+
+
+# analyses are alive while their worker updates the heartbeat this often
+HEARTBEAT_INTERVAL = 30
+HEARTBEAT_TIMEOUT = timedelta(minutes=5)
+
+
+def reap_stale_analyses(sims: list[Simulation]):
+    """Fails analyses whose worker stopped without a signal, e.g. killed on OOM.
+
+    Without it their simulations would hold a worker slot forever.
+    """
+    now = timezone.now()
+    stale = [
+        sim
+        for sim in sims
+        if sim.is_running()
+        and (sim.heartbeat_at is None or now - sim.heartbeat_at > HEARTBEAT_TIMEOUT)
+    ]
+    if len(stale) == 0:
+        return
+    pending = {task.id for task in HUEY.pending()}
+    for sim in stale:
+        if sim.status == Simulation.Status.QUEUED and (
+            str(sim.analysis_task_id) in pending
+        ):
+            # still waiting for a worker
+            continue
+        print(f"Analysis of {sim} stopped without a signal", flush=True)
+        sim.status = Simulation.Status.FAILED
+        sim.save(update_fields=["status"])
+        remove_files_if_deleted(sim)
+
+
+@contextlib.contextmanager
+def analysis_heartbeat(task_id: str):
+    stopped = threading.Event()
+
+    def beat():
+        try:
+            while not stopped.wait(HEARTBEAT_INTERVAL):
+                Simulation.objects.filter(analysis_task_id=task_id).update(
+                    heartbeat_at=timezone.now()
+                )
+        finally:
+            # closes the connection of this thread only
+            connections.close_all()
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def dispatch_analyses():
+    """Queues the analyses picked by the scheduler, as many as there are free workers.
+
+    Called when a simulation is ready and when an analysis ends, huey only ever
+    holds analyses a worker can start right away.
+    """
+    with transaction.atomic():
+        # locked in one order, so concurrent dispatches wait for each other
+        sims = list(
+            Simulation.objects.select_for_update()
+            .filter(
+                status__in=[
+                    Simulation.Status.READY,
+                    Simulation.Status.QUEUED,
+                    Simulation.Status.RUNNING,
+                ]
+            )
+            .order_by("pk")
+        )
+        reap_stale_analyses(sims)
+        in_flight = [sim for sim in sims if sim.is_running()]
+        waiting = [
+            sim
+            for sim in sims
+            if sim.status == Simulation.Status.READY
+            and sim.is_not_queued()
+            and not sim.was_deleted
+        ]
+        slots = settings.ANALYSIS_SLOTS - len(in_flight)
+        for sim in pick_analyses(waiting, in_flight, slots, timezone.now()):
+            queue_analysis(sim)
+
+
+# expires, so runs queued behind busy workers do not pile up
+@periodic_task(crontab(minute="*/1"), expires=60)
+def dispatch_analyses_periodically():
+    # picks up analyses whose worker ended without sending a signal
+    dispatch_analyses()
+
+
+def queue_analysis(sim: Simulation):
+    with transaction.atomic():
+        # locked, so a simulation prepared twice is still analysed once
+        sim = Simulation.objects.select_for_update().get(pk=sim.pk)
+        if sim.status != Simulation.Status.READY or not sim.is_not_queued():
+            return
+        if sim.was_deleted:
+            return
+        files = sim.get_trajectory_files()
+        if files is None:
+            return
+        print(f"Queueing analysis of {sim}", flush=True)
+        analysis = start_simulation.s(
+            files.topology,
+            files.trajectory,
+            get_user_work_dir(sim.user_key) / str(sim.sim_id),
+            get_user_results_dir(sim.results_id),
+        )
+        sim.analysis_task_id = analysis.id
+        sim.status = Simulation.Status.QUEUED
+        sim.frames_done = 0
+        sim.started_at = None
+        sim.heartbeat_at = timezone.now()
+        sim.save()
+        # enqueued once the task id is stored, so signal handlers find the simulation
+        transaction.on_commit(lambda: HUEY.enqueue(analysis))
+
+
+@task(context=True)
 def start_simulation(
-    top_file: Path, traj_file: Path, work_dir: Path, results_dir: Path
+    top_file: Path, traj_file: Path, work_dir: Path, results_dir: Path, task=None
 ):
     # setup for using only specific frames
     print("Starting the simulation!", flush=True)
-    frame_count = get_trajectory_frame_count(top_file, traj_file)
+    analysis_start = time.monotonic()
+    preparation = load_preparation(work_dir)
+    if preparation is None:
+        # queued without preparation, numbering runs while PLIP analyses frames
+        frame_count = get_trajectory_frame_count(top_file, traj_file)
+        seq_chains = get_sequence_chains(top_file, traj_file)
+    else:
+        frame_count = preparation.frame_count
     frames = [x for x in range(frame_count)]
-    plip_dir = work_dir / "plip"
-    frames_dir = work_dir / "frames"
-    get_interactions_from_trajectory(top_file, traj_file, plip_dir, frames_dir, frames)
-    analyse_simulation(top_file, traj_file, plip_dir, results_dir)
+    # per run, a restarted analysis may start before the cancelled one cleaned up
+    plip_dir = work_dir / f"plip-{task.id}"
+    frames_dir = work_dir / f"frames-{task.id}"
+    partial_results = PartialResults(plip_dir, results_dir, frame_count)
+    # revoked by cancel_analysis, the flag is shared by the web and huey processes
+    is_cancelled = functools.partial(HUEY.is_revoked, task)
+
+    def on_progress(frames_done: int):
+        _report_progress(task.id, frames_done)
+        partial_results.update(frames_done)
+
+    try:
+        with analysis_heartbeat(task.id), ThreadPoolExecutor(max_workers=1) as executor:
+            if preparation is None:
+                pending_numbering = executor.submit(
+                    _create_numbering_table_in_thread, seq_chains
+                )
+            timings = get_interactions_from_trajectory(
+                top_file,
+                traj_file,
+                plip_dir,
+                frames_dir,
+                frames,
+                on_progress=on_progress,
+                is_cancelled=is_cancelled,
+            )
+            stage_start = time.monotonic()
+            numbering = (
+                preparation.numbering
+                if preparation is not None
+                else pending_numbering.result()
+            )
+            timings["numbering"] = time.monotonic() - stage_start
+            if is_cancelled():
+                # results of a deleted simulation would be written to removed dirs
+                raise AnalysisCancelled("Analysis cancelled before saving results")
+            stage_start = time.monotonic()
+            run_data = analyse_simulation(
+                top_file, traj_file, plip_dir, results_dir, frame_count, numbering
+            )
+            timings["aggregation"] = time.monotonic() - stage_start
+    except AnalysisCancelled as e:
+        print(f"{e}: {work_dir}", flush=True)
+        shutil.rmtree(plip_dir, ignore_errors=True)
+        raise CancelExecution(retry=False)
+    record_analysis(
+        task.id,
+        frame_count,
+        run_data.get("pocket_size") if run_data is not None else None,
+        timings,
+        time.monotonic() - analysis_start,
+    )
     return len(frames)
 
 
+def record_analysis(
+    task_id: str,
+    frame_count: int,
+    pocket_size: int | None,
+    timings: dict[str, float],
+    total_seconds: float,
+):
+    """Stores timings of the analysis for runtime and queue estimates."""
+    sim = Simulation.objects.filter(analysis_task_id=task_id).first()
+    queue_wait = None
+    if sim is not None and sim.queued_at is not None and sim.started_at is not None:
+        queue_wait = (sim.started_at - sim.queued_at).total_seconds()
+    AnalysisRecord.objects.create(
+        simulation=sim,
+        frame_count=frame_count,
+        atom_count=sim.atom_count if sim is not None else None,
+        pocket_size=pocket_size,
+        worker_threads=settings.MAX_THREADS_PER_WORKER,
+        queue_wait_seconds=queue_wait,
+        extraction_seconds=timings["extraction"],
+        plip_seconds=timings["plip"],
+        numbering_seconds=timings["numbering"],
+        aggregation_seconds=timings["aggregation"],
+        total_seconds=total_seconds,
+    )
+
+
+def cancel_analysis(sim: Simulation):
+    """Stops the analysis of the simulation, frees its worker within seconds.
+
+    Queued analyses are skipped by the consumer, running ones see the revocation
+    while PLIP runs and stop it.
+    """
+    if sim.analysis_task_id is None or not sim.is_running():
+        return
+    print(f"Cancelling analysis of {sim}", flush=True)
+    # revoked once, the consumer clears the flag of a skipped task, the flag of a
+    # running one is cleared when its last signal arrives
+    HUEY.revoke_by_id(str(sim.analysis_task_id), revoke_once=True)
+
+
+def remove_simulation_files(sim: Simulation):
+    shutil.rmtree(
+        get_user_uploads_dir(sim.user_key) / str(sim.sim_id), ignore_errors=True
+    )
+    shutil.rmtree(get_user_work_dir(sim.user_key) / str(sim.sim_id), ignore_errors=True)
+    shutil.rmtree(get_user_results_dir(str(sim.results_id)), ignore_errors=True)
+
+
+def remove_files_if_deleted(sim: Simulation) -> bool:
+    """Removes files of a simulation deleted while a task used them.
+
+    Called by tasks after they store their final status, delete_simulation stores
+    the flag before reading the status, so one of them sees the other.
+    """
+    if not Simulation.objects.filter(pk=sim.pk, was_deleted=True).exists():
+        return False
+    print(f"Removing files of deleted {sim}", flush=True)
+    remove_simulation_files(sim)
+    return True
+
+
+def delete_simulation(sim: Simulation):
+    """Marks the simulation deleted and removes its files.
+
+    Files of a simulation still prepared or analysed are removed by its task once it
+    stops, PLIP and VMD would fail on missing files.
+    """
+    sim.was_deleted = True
+    sim.save(update_fields=["was_deleted"])
+    sim.refresh_from_db(fields=["status"])
+    if sim.status == Simulation.Status.PREPARING or sim.is_running():
+        cancel_analysis(sim)
+        return
+    remove_simulation_files(sim)
+
+
+def restart_analysis(sim: Simulation):
+    cancel_analysis(sim)
+    sim.analysis_task_id = None
+    sim.status = Simulation.Status.PREPARING
+    sim.frames_done = 0
+    sim.save()
+    (get_user_results_dir(sim.results_id) / PARTIAL_RESULTS_FILENAME).unlink(
+        missing_ok=True
+    )
+
+
+def _create_numbering_table_in_thread(seq_chains: dict[str, dict[int, str]]):
+    try:
+        return create_numbering_table(seq_chains)
+    finally:
+        # the thread opens its own database connection
+        connections.close_all()
+
+
+def _report_progress(task_id: str, frames_done: int):
+    for sim in Simulation.objects.filter(analysis_task_id=task_id):
+        sim.frames_done = frames_done
+        # saved through the model, so dashboards are notified
+        sim.save(update_fields=["frames_done"])
+
+
+ANALYSIS_SIGNAL_STATUS = {
+    SIGNAL_EXECUTING: Simulation.Status.RUNNING,
+    SIGNAL_COMPLETE: Simulation.Status.FINISHED,
+    SIGNAL_ERROR: Simulation.Status.FAILED,
+    SIGNAL_INTERRUPTED: Simulation.Status.FAILED,
+    SIGNAL_CANCELED: Simulation.Status.CANCELLED,
+    SIGNAL_REVOKED: Simulation.Status.CANCELLED,
+}
+
+
+@signal(*ANALYSIS_SIGNAL_STATUS)
+def update_analysis_status(signal, task, exc=None):
+    if task.name != start_simulation.name:
+        return
+    for sim in Simulation.objects.filter(analysis_task_id=task.id):
+        sim.status = ANALYSIS_SIGNAL_STATUS[signal]
+        if signal == SIGNAL_EXECUTING:
+            sim.started_at = timezone.now()
+            sim.heartbeat_at = sim.started_at
+        sim.save(update_fields=["status", "started_at", "heartbeat_at"])
+        if signal != SIGNAL_EXECUTING:
+            remove_files_if_deleted(sim)
+    if signal != SIGNAL_EXECUTING:
+        # the running task only peeks at its revoke flag, it would stay behind
+        HUEY.restore_by_id(task.id)
+        # the worker is free for the next analysis
+        dispatch_analyses()
+
+
+@post_execute()
+def discard_analysis_result(task, task_value, exc):
+    if task.name != start_simulation.name:
+        return
+    # the outcome is stored on the simulation, the result would only pile up,
+    # error results are stored after the error signal, so they are popped here
+    try:
+        HUEY.result(task.id)
+    except TaskException:
+        pass
+
+
 example_results_dir = settings.BASE_DIR / "example_results"
 example_results_dirnames = []
 if example_results_dir.is_dir():
@@ -329,11 +1121,11 @@ def remove_unused_sim_files(sim_files_dir: Path):
         return
     try:
         sim = Simulation.objects.get(sim_id=sim_files_dir.name)
-        status = sim.get_analysis_status()
-        if (
-            status != "Queueing"
-            and status != "Queued"
-            and not status.startswith("Running")
+        if sim.status not in (
+            Simulation.Status.PREPARING,
+            Simulation.Status.READY,
+            Simulation.Status.QUEUED,
+            Simulation.Status.RUNNING,
         ):
             shutil.rmtree(sim_files_dir)
             print(f"Removing directory: {sim_files_dir}", flush=True)
@@ -341,7 +1133,8 @@ def remove_unused_sim_files(sim_files_dir: Path):
         shutil.rmtree(sim_files_dir)
 
 
-@periodic_task(crontab(day="*/1"))
+# once a day, crontab(day="*/1") alone would match every minute
+@periodic_task(crontab(minute="0", hour="3"))
 def clean_user_uploads():
     print("Running routine cleanup...")
     uploads_dir = settings.BASE_DIR / "user_uploads"
@@ -354,6 +1147,10 @@ def clean_user_uploads():
         if dir.is_file() and dir.suffix == ".log":
             continue
 
+        # managed by nginx, bodies are removed when their request finishes
+        if dir == settings.UPLOAD_BODIES_DIR:
+            continue
+
         if "-" in dir.name:
             analysis_dirs.append(dir)
         else:
@@ -28,15 +28,22 @@ urlpatterns = [
     path("dashboard/api/sim/start", views.start_sim),
     path("dashboard/api/sim/rename", views.rename_sim),
     path("dashboard/api/sims-data", views.send_sims_data),
+    path("dashboard/api/sims-events", views.stream_sims_events),
+    path("dashboard/api/sims-estimates", views.send_sims_estimates),
+    path("dashboard/api/upload-config", views.send_upload_config),
     path("dashboard/api/group/start", views.run_group_analysis),
     path("dashboard/api/group/delete", views.delete_group_analysis),
+    path("dashboard/api/group/add", views.add_to_group_analysis),
+    path("dashboard/api/group/remove", views.remove_from_group_analysis),
     path("dashboard/api/group/history", views.send_analyses_history),
     path("dashboard/", views.dashboard),
     path("show/<str:sim_id>", views.show),
+    path("show/<str:sim_id>/partial", views.show_partial),
     path("show/group/<str:group_id>", views.show_group),
     path("admin/", admin.site.urls),
     path("", views.redirect_to_dashboard),
     path("about/", views.render_about),
+    path("download/<uuid:group_id>/group.csv", views.download_group_data),
     path("download/<path:filepath>/", views.download_file, name="download_file"),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
 
@@ -1,11 +1,13 @@
 from dataclasses import dataclass
 from pathlib import Path
-import shutil
+import errno
+import io
+import os
 from typing import BinaryIO
-import hashlib
 
 from django.http.request import QueryDict
 from django.conf import settings
+from django.core.cache import cache
 
 
 def get_user_uploads_dir(session_key) -> Path:
@@ -20,6 +22,52 @@ def get_user_work_dir(session_key) -> Path:
     return settings.BASE_DIR / "user_uploads" / session_key / "work"
 
 
+# upload state left in the cache longer than this is dropped, with its upload
+UPLOAD_STATE_TIMEOUT = (settings.MAXIMUM_UPLOAD_TIME_IN_MINUTES or 60) * 60
+
+
+# chunks are copied to their file in blocks of at most this size
+WRITE_BLOCK_SIZE = 1024 * 1024
+
+
+def _increment(key: str) -> int:
+    # atomic in redis, workers counting the same key never lose an increment
+    cache.add(key, 0, UPLOAD_STATE_TIMEOUT)
+    return cache.incr(key)
+
+
+def write_chunk(file_handle: BinaryIO, fd: int, offset: int) -> None:
+    """Writes the rest of file_handle to fd at offset."""
+    try:
+        source_fd = file_handle.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        # in memory, e.g. small multipart uploads
+        source_fd = None
+    if source_fd is not None:
+        # the descriptor's position may be ahead of the handle's, after buffered reads
+        source_offset = file_handle.tell()
+        try:
+            # copied by the kernel, on the same filesystem often without any copy
+            while copied := os.copy_file_range(
+                source_fd, fd, WRITE_BLOCK_SIZE, source_offset, offset
+            ):
+                source_offset += copied
+                offset += copied
+            return
+        except OSError as e:
+            if e.errno not in (
+                errno.EXDEV,
+                errno.ENOSYS,
+                errno.EINVAL,
+                errno.EOPNOTSUPP,
+            ):
+                raise
+            # not supported between these files, the rest is copied below
+            file_handle.seek(source_offset)
+    while block := file_handle.read(WRITE_BLOCK_SIZE):
+        offset += os.pwrite(fd, block, offset)
+
+
 # Front-end salt maybe?
 @dataclass
 class ResumableFile:
@@ -27,72 +75,77 @@ class ResumableFile:
     file_id: str
     filename: str
     total_chunks: int
-    chunks_added: int
-    chunks: list[Path | None]
+    # every chunk but the last one has this size, the last one may be larger
+    chunk_size: int
+    total_size: int
     write_directory: Path
-
-    temp_files_path: Path
+    # allocated on disk while handling this request, by the chunk creating the file
+    allocated_bytes: int = 0
+
+    def _chunk_key(self, chunk_number: int) -> str:
+        return f"resumable-chunk:{self.file_id}:{chunk_number}"
+
+    def _chunks_added_key(self) -> str:
+        return f"resumable-chunks-added:{self.file_id}"
+
+    def file_path(self) -> Path:
+        return (self.write_directory / self.relative_path).parent / self.filename
+
+    def open_file(self) -> int:
+        """Opens the file for writing, allocates its full size when creating it."""
+        path = self.file_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            # created by an earlier chunk, possibly on another worker
+            return os.open(path, os.O_WRONLY)
+        if self.total_size > 0:
+            try:
+                os.posix_fallocate(fd, 0, self.total_size)
+                self.allocated_bytes = self.total_size
+            except OSError:
+                # not supported by the filesystem, chunks fill a sparse file
+                os.ftruncate(fd, self.total_size)
+        return fd
 
     def add_chunk(self, chunk_number: int, file_handle: BinaryIO) -> tuple[bool, bool]:
-        """Adds chunk if doesn't exist yet.
-        When all chunks are collected, writes out the whole file.
+        """Writes chunk at its offset in the file, if doesn't exist yet.
+        Returns whether the chunk is stored and whether the file is complete.
         """
         if self.has_chunk(chunk_number=chunk_number):
             return True, False
-        path_hash = hashlib.md5(self.relative_path.encode("utf-8")).hexdigest()
-        chunk_file_path = self.temp_files_path / f"{path_hash}_chunk_{chunk_number}"
-        self.temp_files_path.mkdir(parents=True, exist_ok=True)
-        with open(chunk_file_path, "wb") as f:
-            f.write(file_handle.read())
-        self.chunks[chunk_number - 1] = chunk_file_path
-
-        chunk_written = True
-        self.chunks_added += 1
-        file_writen = False
-        if self.total_chunks == self.chunks_added:
-            print("writing out file", flush=True)
-            self.write_finished_file()
-            file_writen = True
-
-        print(f"chunk file created!: {chunk_file_path}", flush=True)
-        return chunk_written, file_writen
+        offset = (chunk_number - 1) * self.chunk_size
+        fd = self.open_file()
+        try:
+            # a retried chunk can reach two workers at once, both write the same bytes
+            write_chunk(file_handle, fd, offset)
+        finally:
+            os.close(fd)
+        if not cache.add(self._chunk_key(chunk_number), True, UPLOAD_STATE_TIMEOUT):
+            # counted by the worker that stored it first
+            return True, False
 
-    def has_chunk(self, chunk_number: int) -> bool:
-        return self.chunks[chunk_number - 1] is not None
+        # chunk marks expire with the upload state, so late retries are not recounted
+        file_written = _increment(self._chunks_added_key()) == self.total_chunks
+        if file_written:
+            print(f"file complete!: {self.file_path()}", flush=True)
+        return True, file_written
 
-    def write_finished_file(self) -> bool:
-        """Writes file with all chunks to specified location.
-        Returns true if succeded, false otherwise.
-        """
-        containing_dir = (self.write_directory / self.relative_path).parent
-        containing_dir.mkdir(parents=True, exist_ok=True)
-        with open(containing_dir / self.filename, "wb") as f:
-            for chunk in self.chunks:
-                if chunk is None:
-                    return False
-                with open(chunk, "rb") as f_chunk:
-                    f.write(f_chunk.read())
-        return True
+    def has_chunk(self, chunk_number: int) -> bool:
+        return cache.get(self._chunk_key(chunk_number)) is not None
 
-    def remove_temp_directory(self) -> None:
-        """Remove directory with chunks."""
-        shutil.rmtree(self.temp_files_path)
+    def chunks_added(self) -> int:
+        return cache.get(self._chunks_added_key(), 0)
 
 
 class ResumableFilesManager:
-    managed_files: dict[str, ResumableFile]
-    managed_directories: dict[Path, list[ResumableFile]]
-    directory_file_count: dict[Path, list[int]]
-    # directory_file_count = [files_received_count, files_expected_count]
+    """Assembles resumable.js uploads, any web worker may receive any chunk.
 
-    def __init__(self) -> None:
-        self.managed_files = {}
-        self.managed_directories = {}
-        self.directory_file_count = {}
-
-    def clean(self) -> None:
-        # TODO!!
-        pass
+    Received chunks and written files are counted in the cache, the worker that
+    stores the last chunk of a file writes it out and the one that writes the last
+    file of a directory completes the directory. Uploads survive worker restarts.
+    """
 
     def get_writing_directory(
         self, resumable_data: QueryDict, main_write_directory: Path
@@ -100,97 +153,82 @@ class ResumableFilesManager:
         base_dir = Path(resumable_data.get("resumableRelativePath") or "").parts[0]
         return main_write_directory / base_dir
 
-    def check_if_directory_finished(self, write_directory: Path):
+    def _files_written_key(self, write_directory: Path) -> str:
+        return f"resumable-files-written:{write_directory}"
+
+    def check_if_directory_finished(
+        self, write_directory: Path, expected_file_count: int
+    ) -> bool:
         return (
-            self.directory_file_count[write_directory][0]
-            == self.directory_file_count[write_directory][1]
+            cache.get(self._files_written_key(write_directory), 0)
+            == expected_file_count
         )
 
-    def pop_managed_directory(self, write_directory):
-        files = self.managed_directories[write_directory]
-        for file in files:
-            self.managed_files.pop(file.file_id, None)
-        self.managed_directories.pop(write_directory, None)
+    def get_file(
+        self, resumable_data: QueryDict, main_write_directory: Path
+    ) -> ResumableFile | None:
+        file_id = resumable_data.get("resumableIdentifier", "") + resumable_data.get(
+            "uploadUUID", ""
+        )
+        print("FILE ID:", file_id, flush=True)
+        if file_id == "":
+            return None
+        # every chunk request carries the whole description of its file
+        return ResumableFile(
+            total_chunks=int(resumable_data.get("resumableTotalChunks") or 0),
+            chunk_size=int(resumable_data.get("resumableChunkSize") or 0),
+            total_size=int(resumable_data.get("resumableTotalSize") or 0),
+            filename=resumable_data.get("resumableFilename") or "",
+            relative_path=resumable_data.get("resumableRelativePath") or "",
+            write_directory=self.get_writing_directory(
+                resumable_data, main_write_directory
+            ),
+            file_id=file_id,
+        )
 
     def handle_resumable_post_request(
         self,
         resumable_data: QueryDict,
         file_handle: BinaryIO,
         main_write_directory: Path,
-    ) -> tuple[bool, Path | None]:
-        file_id = resumable_data.get("resumableIdentifier", "") + resumable_data.get(
-            "uploadUUID", ""
-        )
-        print("FILE ID:", file_id, flush=True)
-        base_dir = Path(resumable_data.get("resumableRelativePath") or "").parts[0]
-        temp_dir = main_write_directory / "temp" / base_dir
-        write_directory = self.get_writing_directory(
-            resumable_data, main_write_directory
-        )
-        if file_id is None:
-            return False, None
-        if write_directory not in self.managed_directories:
-            self.managed_directories[write_directory] = []
-            expected_file_count = int(resumable_data.get("fileCount") or 0)
-            self.directory_file_count[write_directory] = [0, expected_file_count]
-        handler = self.managed_files.get(file_id, None)
+    ) -> tuple[bool, Path | None, int]:
+        """Stores a chunk, returns whether it is stored, the directory when complete
+        and the bytes allocated on disk for the upload while storing it.
+        """
+        handler = self.get_file(resumable_data, main_write_directory)
         if handler is None:
-            handler = ResumableFile(
-                total_chunks=int(resumable_data.get("resumableTotalChunks") or 0),
-                filename=resumable_data.get("resumableFilename") or "",
-                relative_path=resumable_data.get("resumableRelativePath") or "",
-                chunks_added=0,
-                chunks=(
-                    [None] * int(resumable_data.get("resumableTotalChunks") or "0")
-                ),
-                write_directory=write_directory,
-                temp_files_path=temp_dir,
-                file_id=file_id,
-            )
-            self.managed_directories[write_directory].append(handler)
-            self.managed_files[file_id] = handler
+            return False, None, 0
+        write_directory = handler.write_directory
         chunk_number = resumable_data.get("resumableChunkNumber") or 0
         chunk_written, file_written = handler.add_chunk(
             chunk_number=int(chunk_number), file_handle=file_handle
         )
-        print("Chunks added: ", handler.chunks_added, flush=True)
+        print("Chunks added: ", handler.chunks_added(), flush=True)
         directory_complete = False
         if file_written:
             print(f"File written: {resumable_data.get('resumableFilename')}")
-            self.directory_file_count[write_directory][0] += 1
-            directory_complete = self.check_if_directory_finished(write_directory)
+            files_written = _increment(self._files_written_key(write_directory))
+            directory_complete = files_written == int(
+                resumable_data.get("fileCount") or 0
+            )
             if directory_complete:
-                print("Popping managed directory!")
-                self.pop_managed_directory(write_directory)
-        return chunk_written, write_directory if directory_complete else None
+                print("Directory complete!")
+        return (
+            chunk_written,
+            write_directory if directory_complete else None,
+            handler.allocated_bytes,
+        )
 
     def handle_resumable_get_request(
         self, resumable_data: QueryDict, main_write_directory: Path
     ) -> tuple[bool, Path | None]:
-        write_directory = self.get_writing_directory(
-            resumable_data, main_write_directory
-        )
-        file_id = resumable_data.get("resumableIdentifier", "") + resumable_data.get(
-            "uploadUUID", ""
-        )
-        print("FILE ID:", file_id, flush=True)
-
-        if file_id == "":
-            return False, None
-        if write_directory not in self.managed_directories:
-            return False, None
-        handler = self.managed_files.get(file_id, None)
+        handler = self.get_file(resumable_data, main_write_directory)
         if handler is None:
             return False, None
         has_chunk = handler.has_chunk(
             int(resumable_data.get("resumableChunkNumber") or 0)
         )
-        dir_ready = self.check_if_directory_finished(write_directory)
-        return has_chunk, write_directory if dir_ready else None
-
-    def list_completed_directories(self):
-        return [
-            dir
-            for dir in self.managed_directories
-            if self.check_if_directory_finished(dir)
-        ]
+        dir_ready = self.check_if_directory_finished(
+            handler.write_directory, int(resumable_data.get("fileCount") or 0)
+        )
+        return has_chunk, handler.write_directory if dir_ready else None
@@ -1,43 +1,34 @@
 from pathlib import Path
 import csv
+import hmac
 import json
 import logging
-import shutil
 
-from django.http import HttpResponse, HttpResponseRedirect
+import pandas as pd
+
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import render
-from django.http import FileResponse, Http404
+from django.http import FileResponse, Http404, JsonResponse
 from django.template.loader import render_to_string
 from django.conf import settings
 
 from ligand_service.utils import (
     ResumableFilesManager,
     get_user_uploads_dir,
-    get_user_work_dir,
     get_user_results_dir,
 )
 
-from .models import GroupAnalysis, Simulation, get_trajectory_frame_count
-from . import tasks
+from .models import GroupAnalysis, Simulation
+from . import admission, estimation, events, tasks
 
 logger = logging.getLogger(__name__)
 file_manager = ResumableFilesManager()
 
 
-def start_sim_task(sim: Simulation, session_key: str):
+def start_sim_task(sim: Simulation):
     if sim.is_not_queued():
-        files = sim.get_trajectory_files()
-        print("Starting simulation!", flush=True)
-        if files is None:
-            return HttpResponse()
-        print("Files are not None!", flush=True)
-        sim.analysis_task_id = tasks.start_simulation(
-            files.topology,
-            files.trajectory,
-            get_user_work_dir(session_key) / str(sim.sim_id),
-            get_user_results_dir(sim.results_id),
-        ).id
-        sim.save()
+        print("Preparing simulation!", flush=True)
+        tasks.prepare_simulation(str(sim.sim_id))
 
 
 def rename_sim(request):
@@ -54,16 +45,57 @@ def start_sim(request):
     print(body, flush=True)
     session_key = request.session.session_key
     sim = Simulation.objects.get(user_key=session_key, sim_id=body["sim_id"])
-    start_sim_task(sim, session_key)
+    if not sim.is_not_queued():
+        # restarting, the previous analysis gives its worker back
+        tasks.restart_analysis(sim)
+    start_sim_task(sim)
     return HttpResponse()
 
 
+def is_from_upload_proxy(request) -> bool:
+    secret = request.headers.get("X-Upload-Proxy-Secret", "")
+    return (
+        settings.UPLOAD_PROXY_SECRET is not None
+        and secret != ""
+        and hmac.compare_digest(secret, settings.UPLOAD_PROXY_SECRET)
+    )
+
+
+def get_upload_chunk(request):
+    """Body of an upload chunk, written to a file by nginx or sent to django."""
+    body_file = request.headers.get("X-Upload-Body", "")
+    if body_file != "":
+        # anyone can send the header, only nginx knows the secret
+        if not is_from_upload_proxy(request):
+            print("Rejecting upload body not sent by nginx", flush=True)
+            return None
+        proxy_path = Path(body_file)
+        if not proxy_path.is_relative_to(settings.UPLOAD_BODIES_PROXY_DIR):
+            return None
+        body_path = (
+            settings.UPLOAD_BODIES_DIR
+            / proxy_path.relative_to(settings.UPLOAD_BODIES_PROXY_DIR)
+        ).resolve()
+        if not body_path.is_relative_to(settings.UPLOAD_BODIES_DIR.resolve()):
+            return None
+        return open(body_path, "rb")
+    if request.content_type == "application/octet-stream":
+        return request
+    return request.FILES.get("file", None)
+
+
 def upload_sim(request):
     if not request.session.session_key:
         request.session.create()
-    if request.POST.get("uploadUUID", "") == "":
+    # octet-stream chunks carry the resumable parameters only in the query string
+    params = (
+        request.GET
+        if request.content_type == "application/octet-stream"
+        else request.POST
+    )
+    if params.get("uploadUUID", "") == "":
         return HttpResponse(status=400)
-    total_size = request.POST.get("totalFileSizeInMB", "")
+    total_size = params.get("totalFileSizeInMB", "")
     if total_size == "" or total_size is None:
         return HttpResponse(status=400)
     if (
@@ -71,53 +103,58 @@ def upload_sim(request):
         and settings.MAXIMUM_UPLOAD_SIZE_IN_MB < float(total_size)
     ):
         return HttpResponse(status=400)
-    if settings.MAXIMUM_UPLOADS_IN_QUEUE is not None:
-        sims = Simulation.objects.filter(user_key=request.session.session_key)
-        in_queue_count = 0
-        print("Counting sims...")
-        for sim in sims:
-            status = sim.get_analysis_status()
-            if (
-                status == "Queueing"
-                or status == "Queued"
-                or status.startswith("Running")
-            ):
-                in_queue_count += 1
-        print(f"Counted {in_queue_count} sims in quque")
-        if in_queue_count >= settings.MAXIMUM_UPLOADS_IN_QUEUE:
-            print("Rejecting due to queue limit!")
-            return HttpResponse(status=400)
+    # decided at the first chunk of an upload, later chunks only read the decision
+    try:
+        admitted = admission.admit_upload(
+            request.session.session_key,
+            params.get("uploadUUID", ""),
+            int(float(total_size) * admission.BYTES_PER_MB),
+        )
+    except admission.UploadDeferred as e:
+        print(f"Deferring upload: {e}", flush=True)
+        response = HttpResponse(str(e), status=503)
+        response["Retry-After"] = str(e.retry_after)
+        return response
+    if not admitted:
+        return HttpResponse(status=400)
 
     if request.method == "POST":
-        _, dir_complete = file_manager.handle_resumable_post_request(
-            request.POST,
-            request.FILES.get("file", None),
-            get_user_uploads_dir(request.session.session_key)
-            / request.POST.get("uploadUUID", ""),
+        chunk = get_upload_chunk(request)
+        if chunk is None:
+            return HttpResponse(status=400)
+        try:
+            _, dir_complete, allocated_bytes = (
+                file_manager.handle_resumable_post_request(
+                    params,
+                    chunk,
+                    get_user_uploads_dir(request.session.session_key)
+                    / params.get("uploadUUID", ""),
+                )
+            )
+        finally:
+            chunk.close()
+        admission.release_allocated_bytes(
+            request.session.session_key, params.get("uploadUUID", ""), allocated_bytes
         )
         if dir_complete is not None:
             print("Adding new simulation file!", flush=True)
+            admission.release_upload(
+                request.session.session_key, params.get("uploadUUID", "")
+            )
             try:
-                sim = Simulation(
+                # files are validated by the preparation task, not in the request
+                sim = Simulation.objects.create(
                     dirname=dir_complete.name,
                     user_key=request.session.session_key,
-                    sim_id=request.POST.get("uploadUUID", ""),
-                )
-                files = sim.get_trajectory_files()
-                if files is None:
-                    sim.delete()
-                    return HttpResponse(422)
-                sim.frame_count = get_trajectory_frame_count(
-                    files.topology, files.trajectory
+                    sim_id=params.get("uploadUUID", ""),
+                    status=Simulation.Status.PREPARING,
+                    priority=(
+                        Simulation.Priority.HIGH
+                        if request.user.is_staff
+                        else Simulation.Priority.NORMAL
+                    ),
                 )
-                if (
-                    settings.MAXIMUM_FRAMES_PER_SIMULATION is not None
-                    and settings.MAXIMUM_FRAMES_PER_SIMULATION < sim.frame_count
-                ):
-                    sim.delete()
-                    return HttpResponse(422)
-                sim.save()
-                start_sim_task(sim, request.session.session_key)
+                start_sim_task(sim)
             except Exception as e:
                 print(f"Db error: {e}")
     # elif request.method == "GET":
@@ -152,16 +189,8 @@ def delete_sim(request):
     sim = Simulation.objects.get(
         user_key=request.session.session_key, sim_id=body["sim_id"]
     )
-    sim.was_deleted = True
-    sim.save()
     # sim.delete()
-    session_key = request.session.session_key
-    shutil.rmtree(
-        get_user_uploads_dir(session_key) / str(sim.sim_id),
-        ignore_errors=True,
-    )
-    shutil.rmtree(get_user_work_dir(session_key) / str(sim.sim_id), ignore_errors=True)
-    shutil.rmtree(get_user_results_dir(str(sim.results_id)), ignore_errors=True)
+    tasks.delete_simulation(sim)
     return HttpResponse()
 
 
@@ -178,6 +207,7 @@ def send_sims_data(request):
     #        print("FAILED: ", sim.has_failed())
     #        print("---", flush=True)
 
+    # estimates are served by send_sims_estimates, refreshes stay a single query
     sims_data = render_to_string("submit/sims_data.html", {"user_dirs": sims})
     headers = {
         "Content-Type": "text/html; charset=utf-8",
@@ -185,6 +215,51 @@ def send_sims_data(request):
     return HttpResponse(sims_data, headers=headers)
 
 
+def send_upload_config(request):
+    # resumable.js options, so chunks fit the limits of nginx and the workers
+    return JsonResponse(
+        {
+            "chunkSize": settings.UPLOAD_CHUNK_SIZE_IN_MB * admission.BYTES_PER_MB,
+            "simultaneousUploads": settings.UPLOAD_SIMULTANEOUS_CHUNKS,
+            "method": "octet",
+        }
+    )
+
+
+def send_sims_estimates(request):
+    estimates = estimation.estimate_queue()
+    sims = Simulation.objects.filter(
+        user_key=request.session.session_key, was_deleted=False
+    )
+    return JsonResponse(
+        {
+            str(sim.sim_id): {
+                "startsInSeconds": estimates[sim.pk].starts_in,
+                "finishesInSeconds": estimates[sim.pk].finishes_in,
+                "description": estimates[sim.pk].describe(),
+            }
+            for sim in sims
+            if sim.pk in estimates
+        }
+    )
+
+
+def stream_sims_events(request):
+    if not events.events_enabled() or not request.session.session_key:
+        # 204 tells the browser not to reconnect, the dashboard keeps polling
+        return HttpResponse(status=204)
+    stream = events.open_event_stream(request.session.session_key)
+    if stream is None:
+        # every stream holds a thread, the others are kept for regular requests
+        return HttpResponse(status=204)
+    # closed by django when the response ends, which frees the stream's slot
+    response = StreamingHttpResponse(stream, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # nginx would otherwise hold events back in its buffer
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
 def send_analyses_history(request):
     sims_data = render_to_string(
         "submit/history.html",
@@ -254,8 +329,62 @@ def run_group_analysis(request):
             print(idx, flush=True)
             writer.writerow([value[idx] for (key, value) in parsed_data.items()])
 
-    tasks.analyse_group(results_dirs, dir)
+    tasks.start_group_analysis(results_dirs, dir)
+
+    return HttpResponse()
+
 
+def add_to_group_analysis(request):
+    body = json.loads(request.body)
+    analysis = GroupAnalysis.objects.get(
+        user_key=request.session.session_key, results_id=body["resultsId"]
+    )
+    added_sims = []
+    rows = []
+    for sim_info in body["sims"]:
+        sim = Simulation.objects.get(
+            results_id=sim_info["simId"], user_key=request.session.session_key
+        )
+        if not sim.is_finished():
+            # only finished analyses have interactions to add
+            print(f"Rejecting group member {sim}, not analysed yet", flush=True)
+            return HttpResponse(status=400)
+        added_sims.append(sim)
+        rows.append(
+            {
+                "Simulation name": sim_info["simName"],
+                "Simulation ID": str(sim.results_id),
+                **sim_info.get("values", {}),
+            }
+        )
+    print("Adding to group analysis:", added_sims, flush=True)
+    group_result_dir = get_user_results_dir(str(analysis.results_id))
+    members = pd.DataFrame(rows)
+    try:
+        # checked here, so bad values are reported to the user, not the worker
+        tasks.new_group_members(group_result_dir, members)
+    except ValueError as e:
+        print(f"Rejecting group members: {e}", flush=True)
+        return HttpResponse(status=400)
+    tasks.start_adding_group_members(group_result_dir, members)
+    analysis.sims.add(*added_sims)
+    return HttpResponse()
+
+
+def remove_from_group_analysis(request):
+    body = json.loads(request.body)
+    analysis = GroupAnalysis.objects.get(
+        user_key=request.session.session_key, results_id=body["resultsId"]
+    )
+    removed_sims = analysis.sims.filter(results_id__in=body["simIds"])
+    if analysis.sims.count() - removed_sims.count() < 2:
+        return HttpResponse(status=400)
+    print("Removing from group analysis:", removed_sims, flush=True)
+    tasks.start_removing_group_members(
+        get_user_results_dir(str(analysis.results_id)),
+        [str(sim.results_id) for sim in removed_sims],
+    )
+    analysis.sims.remove(*removed_sims)
     return HttpResponse()
 
 
@@ -280,6 +409,7 @@ def dashboard(request):
                 user_key=request.session.session_key
             ),
             "MAXIMUM_UPLOAD_SIZE_IN_MB": settings.MAXIMUM_UPLOAD_SIZE_IN_MB,
+            "UPLOAD_RETRY_AFTER_SECONDS": settings.UPLOAD_RETRY_AFTER_SECONDS,
         },
     )
 
@@ -296,6 +426,16 @@ def show(request, sim_id):
     sim_results_dir = get_user_results_dir(sim_id)
     if not sim_results_dir.is_dir():
         return HttpResponseRedirect("/dashboard/")
+    if not (sim_results_dir / "run_data.json").is_file():
+        # partial results of a running analysis are already in the directory
+        return render(
+            request,
+            "search/ongoing.html",
+            {
+                "job_id": sim_id,
+                "partial": tasks.load_partial_results(sim_results_dir),
+            },
+        )
     with open(get_user_results_dir(sim_id) / "run_data.json") as f:
         run_data = json.load(f)
     return render(
@@ -307,12 +447,21 @@ def show(request, sim_id):
     )
 
 
+def show_partial(request, sim_id):
+    partial_results = tasks.load_partial_results(get_user_results_dir(sim_id))
+    if partial_results is None:
+        raise Http404("No partial results")
+    return JsonResponse(partial_results)
+
+
 def show_group(request, group_id):
     print("GOT SIM_ID:", group_id)
     group_result_dir = get_user_results_dir(group_id)
     if not group_result_dir.is_dir():
         return HttpResponseRedirect("/dashboard/")
-    with open(get_user_results_dir(group_id) / "group_data.json") as f:
+    if not (group_result_dir / "group_data.json").is_file():
+        return render(request, "search/ongoing.html", {"job_id": group_id})
+    with open(group_result_dir / "group_data.json") as f:
         group_data = json.load(f)
     return render(
         request,
@@ -323,6 +472,24 @@ def show_group(request, group_id):
     )
 
 
+def download_group_data(request, group_id):
+    group_result_dir = get_user_results_dir(group_id)
+    # written by groups not updated since their members got their own files
+    if (group_result_dir / "group.csv").is_file():
+        return FileResponse(
+            open(group_result_dir / "group.csv", "rb"),
+            as_attachment=True,
+            filename="group.csv",
+        )
+    if not (group_result_dir / "exp_data.csv").is_file():
+        raise Http404("Group does not exist")
+    response = StreamingHttpResponse(
+        tasks.iter_group_csv(group_result_dir), content_type="text/csv"
+    )
+    response["Content-Disposition"] = 'attachment; filename="group.csv"'
+    return response
+
+
 # fallback, normally handled by nginx
 def download_file(request, filepath):
     filepath = Path("./user_uploads/" + filepath)
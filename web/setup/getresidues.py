@@ -0,0 +1,73 @@
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+# run after makeblastdb.py, which downloads the receptor list
+GPCRDB_RESIDUES_EXTENDED_ENDPOINT = "https://gpcrdb.org/services/residues/extended/"
+receptor_json_filepath = Path("blast/receptor_list.json").absolute()
+bundle_filepath = Path("blast/gpcrdb_residues.sqlite").absolute()
+partial_bundle_filepath = bundle_filepath.with_suffix(".sqlite.tmp")
+
+
+def get_residues(entry_name: str) -> tuple[str, list[dict] | None]:
+    try:
+        r = requests.get(
+            GPCRDB_RESIDUES_EXTENDED_ENDPOINT + entry_name,
+            headers={"accept": "application/json"},
+            timeout=60,
+        )
+    except requests.RequestException as e:
+        print(f"Request for {entry_name} failed: {e}")
+        return entry_name, None
+    if not r.ok:
+        print(f"Request for {entry_name} failed: {r.status_code}")
+        return entry_name, None
+    return entry_name, r.json()
+
+
+with open(receptor_json_filepath, "r") as f_json:
+    entry_names = [receptor["entry_name"] for receptor in json.load(f_json)]
+
+print(f"Downloading residues of {len(entry_names)} receptors from GPCRdb...")
+partial_bundle_filepath.unlink(missing_ok=True)
+db = sqlite3.connect(partial_bundle_filepath)
+db.execute(
+    """CREATE TABLE residues (
+        uniprot TEXT NOT NULL,
+        sequence_number INTEGER NOT NULL,
+        amino_acid TEXT NOT NULL,
+        display_generic_number TEXT,
+        protein_segment TEXT,
+        PRIMARY KEY (uniprot, sequence_number)
+    ) WITHOUT ROWID"""
+)
+failed = []
+with ThreadPoolExecutor(max_workers=8) as executor:
+    for entry_name, residues in executor.map(get_residues, entry_names):
+        if residues is None:
+            failed.append(entry_name)
+            continue
+        db.executemany(
+            "INSERT OR REPLACE INTO residues VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    entry_name,
+                    residue["sequence_number"],
+                    residue["amino_acid"],
+                    residue.get("display_generic_number", ""),
+                    residue.get("protein_segment"),
+                )
+                for residue in residues
+            ],
+        )
+db.commit()
+db.close()
+# replaced at once, so running workers never read a half written bundle
+partial_bundle_filepath.replace(bundle_filepath)
+
+if len(failed) > 0:
+    print(f"WARNING: Residues of {len(failed)} receptors are missing: {failed}")
+print("SUCCESS: GPCRdb residue bundle successfuly created!")